@@ -36,6 +36,18 @@ True
 $1.00 ; 2 ; 2000-01-01
 $4.50 ; 11 ; 2000-04-10
 
+Values are converted to and from the column's datatype.
+
+>>> orders.select(orders.date).one()
+Row(date=datetime.date(2000, 1, 1))
+
+Values in rows can be retrieved by position, column name or attribute.
+
+>>> row = orders.select().one()
+
+>>> row.amount, row['quantity'], row[2]
+(100, '2', datetime.date(2000, 1, 1))
+
 >>> (orders.columns['amount'] == 100)
 Filter('EQUAL', 'orders'.'amount', 100)
 
@@ -43,15 +55,36 @@ Filter('EQUAL', 'orders'.'amount', 100)
 ...   print("${:.02f} ; {} ; {}".format(int(amount)/100., quantity, date))
 $1.00 ; 2 ; 2000-01-01
 
->>> (orders.amount == 100).select(orders.quantity)
+>>> quantities = (orders.amount == 100).select(orders.quantity)
+
+>>> quantities
 <Selection('orders'.'quantity')>
 
+Selections are not executed until they are iterated.
+
+>>> list(quantities)
+[Row(quantity='2')]
+
 >>> print(orders.db.driver.last_statement)
-SELECT "orders"."quantity" FROM "orders" WHERE ("orders"."amount"=100);
+SELECT "orders"."quantity" FROM "orders" WHERE ("orders"."amount"=?);
+
+>>> orders.db.driver.last_values
+[100]
 
 >>> len(orders.select_all())
 2
 
+Counting and other aggregate functions are calculated by the database.
+
+>>> orders.count()
+2
+
+>>> (orders.amount > 200).select().count()
+1
+
+>>> tuple(orders.select(orders.amount.sum(), orders.amount.max()).one())
+(550.0, 450)
+
 >>> orders.update(quantity=5)
 
 >>> for amount, quantity, date in orders.select():
@@ -59,6 +92,22 @@ SELECT "orders"."quantity" FROM "orders" WHERE ("orders"."amount"=100);
 $1.00 ; 5 ; 2000-01-01
 $4.50 ; 5 ; 2000-04-10
 
+Changes can be grouped into transactions, which are committed at once or
+not at all. Nested transactions only undo their own changes.
+
+>>> with mydb.transaction():
+...     orders.insert(amount=300, quantity=1, date='2000-05-01')
+...     try:
+...         with mydb.transaction():
+...             orders.update(quantity=0)
+...             raise ValueError
+...     except ValueError:
+...         pass
+3
+
+>>> orders.select_all(orders.quantity)
+[Row(quantity='5'), Row(quantity='5'), Row(quantity='1')]
+
 >>> orders.delete()
 
 >>> len(orders.select_all())
@@ -78,16 +127,25 @@ dibi.error.NoSuchTableError: Table 'orders' does not exist
 
 
 from .datatype import DataType, Integer, Float, Text, Blob, DateTime, Date
+from .cache import ResultCache
 from .collection import Collection
 from .error import NoSuchTableError, TableAlreadyExists
-from .common import Selection, Selectable, Filter, Column, Table
-from . import driver
+from .common import (Selection, Selectable, Filter, Column, Table, Index,
+                     FullScanCheck)
+from . import datatype, driver
+
+from contextlib import contextmanager
+import json
 
 
 class DB(object):
     def __init__(self, driver):
         self.driver = driver
         self.tables = Collection(lambda table: table.name)
+        self.result_cache = None
+        self.full_scan_check = None
+        # Version of each table by name, see Table.version
+        self.table_versions = {}
 
     @classmethod
     def connect(cls, driver_name, *args, **kwargs):
@@ -128,6 +186,109 @@ class DB(object):
     def __hash__(self):
         return hash(self.driver)
 
+    @contextmanager
+    def transaction(self):
+        """
+        Commit all changes made within the block at once, or none of them
+        if it raises an exception. Blocks may be nested, in which case an
+        exception only undoes changes made in the innermost block.
+
+        Changes can only be undone by databases which support transactions.
+        Others, such as MySQL tables using the MyISAM engine, keep changes
+        even when the block raises, and NonTransactionalWarning is issued
+        when the block begins.
+        """
+        try:
+            with self.driver.transaction():
+                yield self
+        except BaseException:
+            # Cached rows may have been read from the undone changes
+            for table in self.tables:
+                table.clear_row_cache()
+                self.driver.changed(table)
+            raise
+
+    def cache_results(self, maxsize=16 * 1024 * 1024):
+        """
+        Remember the rows returned by selections, up to an estimated
+        maxsize bytes of them. Returns the ResultCache holding them, which
+        counts hits, misses, evictions and invalidations.
+
+        Results are keyed by their statement and values, and discarded once
+        one of the tables they were selected from is changed by dibi.
+        Selections made with cache=False are always read from the database.
+
+        >>> db = DB.connect('sqlite')
+
+        >>> table = db.add_table('colors')
+
+        >>> _ = table.add_column('name', Text)
+
+        >>> table.save()
+
+        >>> cache = db.cache_results()
+
+        >>> _ = table.insert(name='red')
+
+        >>> table.select_all(), table.select_all()
+        ([Row(name='red')], [Row(name='red')])
+
+        >>> _ = table.insert(name='green')
+
+        >>> len(table.select_all()), len(table.select_all(cache=False))
+        (2, 2)
+
+        >>> cache.hits, cache.misses, cache.invalidations
+        (1, 2, 1)
+        """
+        self.result_cache = ResultCache(maxsize)
+        return self.result_cache
+
+    def check_full_scans(self, threshold=1000, error=False):
+        """
+        Examine the query plan of each distinct selection before it is
+        executed, and warn with FullScanWarning if it reads every row of a
+        table with at least threshold rows, or raise FullScanError if error
+        is true. Meant for development, since it costs extra queries.
+        Returns the FullScanCheck, or disables checks if threshold is None.
+
+        >>> import warnings
+
+        >>> db = DB.connect('sqlite')
+
+        >>> table = db.add_table('events')
+
+        >>> _ = table.add_column('kind', Text)
+
+        >>> table.save()
+
+        >>> table.insert_many([('start',), ('stop',)])
+        2
+
+        >>> print((table.kind == 'stop').explain())
+        SCAN events
+
+        >>> _ = db.check_full_scans(threshold=2, error=True)
+
+        >>> (table.kind == 'stop').select_all()
+        Traceback (most recent call last):
+         ...
+        dibi.error.FullScanError: Selecting from 'events' reads all ...
+
+        >>> (table.kind == 'stop').select_all()
+        Traceback (most recent call last):
+         ...
+        dibi.error.FullScanError: Selecting from 'events' reads all ...
+
+        >>> table.add_index('kind').save()
+
+        >>> (table.kind == 'stop').select_all()
+        [Row(kind='stop')]
+        """
+        self.full_scan_check = (None if threshold is None
+                                else FullScanCheck(threshold, error))
+        return self.full_scan_check
+
     def add_table(self, name, primarykey=None):
         if name in self.tables:
             raise TableAlreadyExists(name)
@@ -143,13 +304,131 @@ class DB(object):
         NoSuchTableError: Table 'missing' does not exist
         """
         columns = self.driver.list_columns(name)
+        try:
+            indexes = self.driver.list_indexes(name)
+        except NotImplementedError:
+            indexes = ()
+        return self.make_table(name, columns, indexes)
+
+    def make_table(self, name, columns, indexes):
+        """
+        Returns a Table of columns, with indexes given as (name, column
+        names, unique) tuples, without adding it to this DB's tables.
+        """
         table = Table(self, name)
         for column in columns:
             column.table = table
             column.db = self
             table.columns.add(column)
+            if column.primarykey:
+                table.primarykey = column
+        for index_name, columns, unique in indexes:
+            table.add_index(*columns, unique=unique, name=index_name)
         return table
 
+    def reflect(self, tables=None):
+        """
+        Discover the named tables, or every table in the database, and add
+        them to this DB's tables, replacing any with the same names. Returns
+        the tables discovered.
+
+        Drivers discover all the tables' columns and indexes at once where
+        they can. Use save_schema() and load_schema() to skip discovery
+        entirely.
+
+        >>> from dibi.driver.common import C
+
+        >>> db = DB.connect('sqlite')
+
+        >>> _ = db.driver.execute(C("CREATE TABLE t (a TEXT, b INTEGER)"))
+
+        >>> db.reflect()
+        [Table('t')]
+
+        >>> db.tables['t'].columns
+        Collection('t'.'a', 't'.'b')
+        """
+        discovered = [
+            self.tables.add(self.make_table(name, columns, indexes))
+            for name, columns, indexes in self.driver.reflect(tables)]
+        return discovered
+
+    def schema(self):
+        """
+        Returns a description of the tables dibi knows about, which can be
+        serialized as JSON and given to add_schema().
+        """
+        return dict(version=1, tables=[dict(
+            name=table.name,
+            columns=[dict(
+                name=column.name, datatype=column.datatype.__name__,
+                primarykey=column.primarykey,
+                autoincrement=column.autoincrement, implicit=column.implicit,
+            ) for column in table.columns],
+            indexes=[dict(
+                name=index.name, unique=index.unique,
+                columns=[column.name for column in index.columns],
+            ) for index in table.indexes],
+        ) for table in self.tables])
+
+    def add_schema(self, schema):
+        """
+        Add tables described by schema(), without querying the database.
+        Returns the tables added.
+        """
+        if schema.get('version') != 1:
+            raise ValueError("Unsupported schema version {!r}".format(
+                schema.get('version')))
+        tables = []
+        for description in schema['tables']:
+            columns = [
+                Column(None, None, column['name'],
+                       datatype.named(column['datatype']),
+                       column['primarykey'], column['autoincrement'],
+                       column['implicit'])
+                for column in description['columns']]
+            tables.append(self.tables.add(self.make_table(
+                description['name'], columns, [
+                    (index['name'], index['columns'], index['unique'])
+                    for index in description['indexes']])))
+        return tables
+
+    def save_schema(self, path):
+        """
+        Save schema() to a file, as JSON.
+
+        >>> import os, tempfile
+
+        >>> db = DB.connect('sqlite')
+
+        >>> table = db.add_table('t', primarykey='id')
+
+        >>> _ = table.add_column('label', Text)
+
+        >>> _ = table.add_index('label', unique=True)
+
+        >>> path = os.path.join(tempfile.mkdtemp(), 'schema.json')
+
+        >>> db.save_schema(path)
+
+        >>> other = DB.connect('sqlite')
+
+        >>> other.load_schema(path)
+        [Table('t')]
+
+        >>> other.tables['t'].indexes
+        Collection(Index('t_label_index', 't'.'label', unique=True))
+        """
+        with open(path, 'w') as file:
+            json.dump(self.schema(), file, indent=1)
+
+    def load_schema(self, path):
+        """
+        Add the tables described in a file written by save_schema().
+        """
+        with open(path) as file:
+            return self.add_schema(json.load(file))
+
     def __repr__(self):
         return "<DB({!r})>".format(self.driver)
 
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+"""
+Asyncio front-end to dibi.
+
+Everything an AsyncDB does with its database happens on a thread of its
+own, so the event loop never waits for the database.
+
+>>> import asyncio
+
+>>> from dibi.datatype import Integer
+
+>>> async def main():
+...     db = await AsyncDB.connect('sqlite')
+...     orders = db.add_table('orders')
+...     _ = orders.add_column('amount', Integer)
+...     await orders.save()
+...     async with db.transaction():
+...         for amount in (100, 450, 300):
+...             await orders.insert(amount=amount)
+...     large = db.wrap(orders.amount > 200)
+...     async for row in large.select(arraysize=2):
+...         print(row)
+...     print(await orders.count())
+...     await db.close()
+
+>>> asyncio.run(main())
+Row(amount=450)
+Row(amount=300)
+3
+"""
+
+from . import DB
+from .common import Selectable, Selection, Table
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import partial
+from types import MethodType
+import asyncio
+import sys
+
+
+# Transactions the current task is within, including those its parent tasks
+# had open when it was created
+open_transactions = ContextVar('open_transactions', default=frozenset())
+
+
+class AsyncDB(object):
+    """
+    Wraps a DB so it may be used from coroutines.
+
+    Calls to the database are made one at a time, in order, by a single
+    worker thread, which is the only thread to use the DB's connection.
+    Create an AsyncDB with connect(), so the connection is opened by that
+    thread too.
+
+    While a task is inside transaction(), other tasks using the AsyncDB
+    wait for the transaction to end before their statements are executed.
+    Tasks created within the transaction, for example by asyncio.gather(),
+    take part in it instead.
+
+    >>> from dibi.datatype import Integer
+
+    >>> async def main():
+    ...     db = await AsyncDB.connect('sqlite')
+    ...     table = db.add_table('counts')
+    ...     _ = table.add_column('n', Integer)
+    ...     await table.save()
+    ...     async with db.transaction():
+    ...         await asyncio.gather(*(table.insert(n=n) for n in range(3)))
+    ...     print(await table.count())
+    ...     await db.close()
+
+    >>> asyncio.run(asyncio.wait_for(main(), 10))
+    3
+    """
+
+    def __init__(self, db, executor=None):
+        self.db = db
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='dibi')
+        # Held while a transaction is open, which is then identified by
+        # current
+        self.lock = asyncio.Lock()
+        self.current = None
+
+    @classmethod
+    async def connect(cls, driver_name, *args, **kwargs):
+        executor = ThreadPoolExecutor(max_workers=1,
+                                      thread_name_prefix='dibi')
+        db = await asyncio.get_running_loop().run_in_executor(
+            executor, partial(DB.connect, driver_name, *args, **kwargs))
+        return cls(db, executor)
+
+    def __repr__(self):
+        return "<AsyncDB({!r})>".format(self.db.driver)
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Call function on the worker thread, and return its result.
+        """
+        if not self.within_transaction():
+            # Wait for any other task's transaction to end
+            async with self.lock:
+                pass
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(function, *args, **kwargs))
+
+    async def close(self):
+        await self.run(self.db.driver.close)
+        self.executor.shutdown()
+
+    def within_transaction(self):
+        """
+        Whether the current task is within this AsyncDB's open transaction.
+        """
+        return (self.current is not None and
+                self.current in open_transactions.get())
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Commit all changes made within the block at once, or none of them
+        if it raises an exception. Blocks may be nested, but nested blocks
+        of concurrent tasks must not overlap.
+        """
+        if self.within_transaction():
+            async with self._transaction():
+                yield self
+            return
+        async with self.lock:
+            self.current = object()
+            token = open_transactions.set(
+                open_transactions.get() | {self.current})
+            try:
+                async with self._transaction():
+                    yield self
+            finally:
+                open_transactions.reset(token)
+                self.current = None
+
+    @asynccontextmanager
+    async def _transaction(self):
+        context = self.db.transaction()
+        await self.run(context.__enter__)
+        try:
+            yield
+        except BaseException:
+            if not await self.run(context.__exit__, *sys.exc_info()):
+                raise
+        else:
+            await self.run(context.__exit__, None, None, None)
+
+    def wrap(self, value):
+        """
+        Returns the asynchronous counterpart of a Table, Filter, Join or
+        Selection of this AsyncDB's DB.
+        """
+        if isinstance(value, Table):
+            return AsyncTable(self, value)
+        elif isinstance(value, Selectable):
+            return AsyncSelectable(self, value)
+        elif isinstance(value, Selection):
+            return AsyncSelection(self, value)
+        raise TypeError("Expected Selectable or Selection, got {!r}".format(
+            type(value)))
+
+    def add_table(self, name, primarykey=None):
+        return AsyncTable(self, self.db.add_table(name, primarykey))
+
+    def table(self, name):
+        """
+        Returns the table called name which is known to the DB.
+        """
+        return AsyncTable(self, self.db.tables[name])
+
+    async def find_table(self, name):
+        return AsyncTable(self, await self.run(self.db.find_table, name))
+
+
+class AsyncSelection(object):
+    """
+    Selection whose rows are fetched by the worker thread arraysize at a
+    time, and iterated over with "async for".
+    """
+
+    def __init__(self, db, selection, arraysize=None):
+        self.db = db
+        self.selection = selection
+        self.arraysize = arraysize
+
+    def __repr__(self):
+        return "<Async{}".format(repr(self.selection)[1:])
+
+    async def batches(self, size=None):
+        """
+        Iterate asynchronously over lists of at most size rows.
+        """
+        batches = self.selection.batches(size or self.arraysize)
+        try:
+            while True:
+                rows = await self.db.run(next, batches, None)
+                if rows is None:
+                    return
+                yield rows
+        finally:
+            await self.db.run(batches.close)
+
+    async def __aiter__(self):
+        async for rows in self.batches():
+            for row in rows:
+                yield row
+
+    async def all(self):
+        return await self.db.run(list, self.selection.iter(self.arraysize))
+
+    async def one(self):
+        return await self.db.run(self.selection.one)
+
+    async def count(self):
+        return await self.db.run(self.selection.count)
+
+    async def to_columns(self):
+        return await self.db.run(self.selection.to_columns, self.arraysize)
+
+
+class AsyncSelectable(object):
+    """
+    Asynchronous counterpart of a Table, Filter or Join.
+
+    Attributes which don't involve the database, such as columns, are
+    those of the wrapped object. Other methods of the wrapped object would
+    block the event loop, so are only available through their asynchronous
+    counterparts.
+    """
+
+    # Methods of the wrapped object which don't use the database
+    forwarded = frozenset([
+        'add_column', 'add_index', 'cache_rows', 'clear_row_cache',
+        'default_columns', 'where', 'in_', 'not_in', 'between', 'sum',
+        'average', 'max', 'min', 'asc', 'desc',
+    ])
+
+    def __init__(self, db, selectable):
+        self.db = db
+        self.selectable = selectable
+
+    def __getattr__(self, name):
+        value = getattr(self.selectable, name)
+        if isinstance(value, MethodType) and name not in self.forwarded:
+            raise AttributeError(
+                "{!r} has no asynchronous {!r} method".format(
+                    type(self).__name__, name))
+        return value
+
+    def __repr__(self):
+        return "Async{!r}".format(self.selectable)
+
+    def select(self, *columns, **kwargs):
+        arraysize = kwargs.pop('arraysize', None)
+        return AsyncSelection(
+            self.db, self.selectable.select(*columns, **kwargs), arraysize)
+
+    async def select_all(self, *columns, **kwargs):
+        return await self.select(*columns, **kwargs).all()
+
+    def join(self, other, on=None, kind='inner'):
+        if isinstance(other, AsyncSelectable):
+            other = other.selectable
+        return AsyncSelectable(
+            self.db, self.selectable.join(other, on=on, kind=kind))
+
+    async def count(self):
+        return await self.db.run(self.selectable.count)
+
+    async def explain(self, *columns, **kwargs):
+        return await self.db.run(self.selectable.explain, *columns, **kwargs)
+
+    async def update(self, **values):
+        return await self.db.run(self.selectable.update, **values)
+
+    async def update_in_batches(self, values, batch_size, pause=None,
+                                progress=None):
+        return await self.db.run(
+            self.selectable.update_in_batches, values, batch_size,
+            pause=pause, progress=progress)
+
+    async def delete(self, **kwargs):
+        return await self.db.run(self.selectable.delete, **kwargs)
+
+
+class AsyncTable(AsyncSelectable):
+    """
+    Asynchronous counterpart of a Table.
+
+    >>> from dibi.datatype import Integer, Text
+
+    >>> async def main():
+    ...     db = await AsyncDB.connect('sqlite')
+    ...     stock = db.add_table('stock')
+    ...     _ = stock.add_column('item', Text, primarykey=True)
+    ...     _ = stock.add_column('level', Integer)
+    ...     await stock.save()
+    ...     await stock.insert_many([('nails', 10), ('screws', 5)])
+    ...     await stock.upsert(['item'], item='nails', level=20)
+    ...     await stock.update_many([dict(item='screws', level=0)])
+    ...     rows = await stock.get_many(['nails', 'screws', 'glue'])
+    ...     print(sorted(rows.values()))
+    ...     try:
+    ...         stock.change_in_batches
+    ...     except AttributeError as error:
+    ...         print(error)
+    ...     await db.close()
+
+    >>> asyncio.run(main())
+    [Row(item='nails', level=20), Row(item='screws', level=0)]
+    'AsyncTable' has no asynchronous 'change_in_batches' method
+    """
+
+    async def save(self, force_create=False):
+        return await self.db.run(self.selectable.save, force_create)
+
+    async def drop(self, ignore_absence=True):
+        return await self.db.run(self.selectable.drop, ignore_absence)
+
+    async def insert(self, **values):
+        return await self.db.run(self.selectable.insert, **values)
+
+    async def insert_many(self, rows, batch_size=1000):
+        return await self.db.run(
+            self.selectable.insert_many, rows, batch_size=batch_size)
+
+    async def drop_index(self, index, ignore_absence=True):
+        return await self.db.run(
+            self.selectable.drop_index, index, ignore_absence)
+
+    async def update_many(self, rows, key=None, batch_size=1000):
+        return await self.db.run(
+            self.selectable.update_many, rows, key=key, batch_size=batch_size)
+
+    async def upsert(self, conflict_columns, **values):
+        return await self.db.run(
+            self.selectable.upsert, conflict_columns, **values)
+
+    async def upsert_many(self, conflict_columns, rows, batch_size=1000):
+        return await self.db.run(
+            self.selectable.upsert_many, conflict_columns, rows,
+            batch_size=batch_size)
+
+    async def get_many(self, keys):
+        return await self.db.run(self.selectable.get_many, keys)
+
+    async def get(self, key):
+        """
+        Returns the row whose primary key is key, or None.
+        """
+        return await self.db.run(self.selectable.__getitem__, key)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+import sys
+import threading
+
+
+def estimate_size(rows):
+    """
+    Estimate the memory used by a list of rows, in bytes.
+
+    >>> estimate_size([]) == sys.getsizeof([])
+    True
+    """
+    getsizeof = sys.getsizeof
+    return getsizeof(rows) + sum(
+        getsizeof(row) + sum(map(getsizeof, row)) for row in rows)
+
+
+def table_versions(tables):
+    """
+    Returns the versions of tables, for comparing with later versions.
+    """
+    return tuple(sorted((table.name, table.version) for table in tables))
+
+
+class ResultCache(object):
+    """
+    Rows returned by recently executed selections, keyed by their statement
+    and bound values.
+
+    Results are stored with the versions of the tables they were selected
+    from, and are discarded when they are next looked up if any of those
+    tables have changed since. The least recently used results are
+    discarded once all of them together are estimated to take more than
+    maxsize bytes, and results larger than that are never stored.
+
+    >>> class Table(object):
+    ...     name = 'table'
+    ...     version = 0
+
+    >>> table = Table()
+
+    >>> cache = ResultCache()
+
+    >>> cache.store('statement', table_versions({table}), [(1,), (2,)])
+
+    >>> cache.lookup('statement', table_versions({table}))
+    [(1,), (2,)]
+
+    >>> table.version += 1
+
+    >>> cache.lookup('statement', table_versions({table}))
+
+    >>> cache.hits, cache.misses, cache.invalidations
+    (1, 1, 1)
+    """
+
+    def __init__(self, maxsize=16 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.size = 0
+        # Rows, table versions and size of each result, oldest first
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __repr__(self):
+        return ("<ResultCache({} results, {}/{} bytes, hits={}, "
+                "misses={})>").format(len(self.results), self.size,
+                                      self.maxsize, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self.results)
+
+    def discard(self, key):
+        # Must be called while holding self.lock
+        rows, versions, size = self.results.pop(key)
+        self.size -= size
+
+    def lookup(self, key, versions):
+        """
+        Returns the rows stored for key, or None if there are none or the
+        tables they came from have changed from versions.
+        """
+        with self.lock:
+            try:
+                rows, stored_versions, size = self.results[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if stored_versions != versions:
+                self.discard(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            return rows
+
+    def store(self, key, versions, rows):
+        """
+        Remember rows selected from tables at versions.
+        """
+        size = estimate_size(rows)
+        if size > self.maxsize:
+            return
+        with self.lock:
+            if key in self.results:
+                self.discard(key)
+            self.results[key] = (rows, versions, size)
+            self.size += size
+            while self.size > self.maxsize:
+                self.discard(next(iter(self.results)))
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Discard all results without affecting statistics.
+        """
+        with self.lock:
+            self.results.clear()
+            self.size = 0
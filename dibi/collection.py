@@ -2,6 +2,8 @@
 
 from collections import OrderedDict, MutableSet, MutableMapping, Mapping, Set
 from abc import ABCMeta, abstractmethod
+import threading
+import time
 
 
 class KeyValue(object):
@@ -317,3 +319,126 @@ class OrderedCollection(Collection):
     """
     def __init__(self, key_function, *items):
         Collection.__init__(self, key_function, storage=OrderedDict(), *items)
+
+
+class LRUCache(MutableMapping):
+    """Mapping which discards its least recently used items when full
+
+    Lookups are counted, so the effectiveness of the cache can be measured.
+
+    >>> cache = LRUCache(2)
+
+    >>> cache['a'] = 1
+
+    >>> cache['b'] = 2
+
+    >>> cache['a']
+    1
+
+    >>> cache['c'] = 3
+
+    >>> sorted(cache)
+    ['a', 'c']
+
+    >>> cache.get('b')
+
+    >>> cache.hits, cache.misses, cache.evictions
+    (1, 1, 1)
+
+    If ttl is given, items are also discarded once they are ttl seconds old,
+    as measured by clock.
+
+    >>> now = 0
+
+    >>> cache = LRUCache(2, ttl=10, clock=lambda: now)
+
+    >>> cache['a'] = 1
+
+    >>> now = 11
+
+    >>> cache.get('a')
+
+    >>> cache.misses, cache.expirations
+    (1, 1)
+
+    A lock is held while the cache is read or changed, so it may be shared
+    between threads.
+    """
+    def __init__(self, maxsize=128, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        # Values and the time they expire, if ever
+        self.__items = OrderedDict()
+        self.__lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __repr__(self):
+        return "<LRUCache({}/{}, hits={}, misses={})>".format(
+            len(self), self.maxsize, self.hits, self.misses)
+
+    def __expired(self, expires):
+        return expires is not None and expires <= self.clock()
+
+    def __getitem__(self, key):
+        with self.__lock:
+            try:
+                value, expires = self.__items[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            if self.__expired(expires):
+                del self.__items[key]
+                self.expirations += 1
+                self.misses += 1
+                raise KeyError(key)
+            self.__items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        with self.__lock:
+            self.__items[key] = (value, expires)
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.maxsize:
+                self.__items.popitem(last=False)
+                self.evictions += 1
+
+    def __delitem__(self, key):
+        with self.__lock:
+            del self.__items[key]
+
+    def __contains__(self, key):
+        with self.__lock:
+            try:
+                value, expires = self.__items[key]
+            except KeyError:
+                return False
+            return not self.__expired(expires)
+
+    def __iter__(self):
+        with self.__lock:
+            return iter(list(self.__items))
+
+    def __len__(self):
+        return len(self.__items)
+
+    def clear(self):
+        """Remove all items without affecting statistics
+
+        >>> cache = LRUCache()
+
+        >>> cache['a'] = 1
+
+        >>> cache.clear()
+
+        >>> len(cache)
+        0
+
+        """
+        with self.__lock:
+            self.__items.clear()
@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 
 
-from .collection import Collection, OrderedCollection
+from .cache import table_versions
+from .collection import Collection, OrderedCollection, LRUCache
 from .datatype import (DataType, Integer, Float, Text, Blob, DateTime, Date,
                        AutoIncrement)
-from .error import NoSuchTableError, NoColumnsError, TableAlreadyExists
+from .error import (NoSuchTableError, NoColumnsError, TableAlreadyExists,
+                    CartesianProductWarning, FullScanError, FullScanWarning)
 
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+from functools import lru_cache, partial
+from itertools import chain
+import array
 import datetime
-import sqlite3
+import time
+import warnings
 
 
 class DbObject(object):
@@ -15,26 +23,447 @@ class DbObject(object):
         self.db = db
 
 
+class Row(tuple):
+    """
+    Base class of rows returned by Selections.
+
+    Values may be retrieved by position, by the name of their column, or as
+    attributes. Each distinct list of names has its own subclass, made by
+    row_class().
+
+    >>> row = row_class(('name', 'size'))('dibi', 2)
+
+    >>> row
+    Row(name='dibi', size=2)
+
+    >>> row['size'], row.size, row[-1]
+    (2, 2, 2)
+
+    >>> dict(row.items())
+    {'name': 'dibi', 'size': 2}
+    """
+
+    __slots__ = ()
+
+    # Column names, and the position of the first column with each name
+    _names = ()
+    _positions = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._positions[key]
+        elif isinstance(key, Column):
+            key = self._positions[key.name]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return self._names
+
+    def items(self):
+        return zip(self._names, self)
+
+
+@lru_cache(maxsize=256)
+def row_class(names):
+    """
+    Returns the Row subclass for a tuple of column names.
+
+    Names which aren't valid identifiers are only accessible by position or
+    key, and None stands for a column without a name.
+    """
+    fields = namedtuple('Row', [name or '_' for name in names], rename=True)
+    positions = {}
+    for position, name in enumerate(names):
+        if name is not None:
+            positions.setdefault(name, position)
+    return type('Row', (Row, fields), dict(
+        __slots__=(), _names=names, _positions=positions,
+        __getitem__=Row.__getitem__))
+
+
+PlanStep = namedtuple('PlanStep', ['table', 'detail', 'full_scan'])
+
+
+class QueryPlan(object):
+    """
+    Steps the database would take to execute a statement.
+
+    Each PlanStep has the Table it reads, if any, the database's description
+    of the step, and whether it reads every row of the table.
+    """
+
+    def __init__(self, statement, steps):
+        self.statement = statement
+        self.steps = steps
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __str__(self):
+        return '\n'.join(step.detail for step in self.steps)
+
+    def __repr__(self):
+        return "<QueryPlan({})>".format(", ".join(
+            repr(step.detail) for step in self.steps))
+
+    @property
+    def full_scans(self):
+        """
+        Tables whose every row would be read.
+        """
+        return [step.table for step in self.steps if step.full_scan]
+
+
+class FullScanCheck(object):
+    """
+    Examines the plan of each distinct statement a Selection executes, and
+    warns, or raises FullScanError if error is true, if it reads every row
+    of a table which has at least threshold rows.
+    """
+
+    def __init__(self, threshold=1000, error=False):
+        self.threshold = threshold
+        self.error = error
+        # Statements which have already been checked
+        self.checked = LRUCache(1024)
+
+    def __call__(self, selection):
+        statement, values = selection.statement()
+        if statement in self.checked:
+            return
+        driver = selection.db.driver
+        with driver.connected():
+            try:
+                plan = driver.explain(statement, values, selection.tables)
+            except NotImplementedError:
+                return
+            for table in plan.full_scans:
+                counter = Filter(table.db, 'COUNTALL')
+                cursor = table.select(counter, cache=False).execute()
+                try:
+                    (size,), = cursor.fetchall()
+                finally:
+                    cursor.close()
+                if size >= self.threshold:
+                    message = ("Selecting from {!r} reads all of its {} "
+                               "rows: {}").format(table.name, size, statement)
+                    if self.error:
+                        # Raise again each time the statement is selected
+                        raise FullScanError(message)
+                    warnings.warn(message, FullScanWarning, stacklevel=4)
+        self.checked[statement] = True
+
+
 class Selection(DbObject):
-    def __init__(self, db, columns, tables, criteria, distinct):
+    """
+    Rows of columns from tables which match criteria.
+
+    The query isn't executed until the selection is iterated, and is
+    executed again each time it is. Rows are fetched from the database
+    arraysize at a time. If the DB caches results, the rows are returned
+    from its cache instead, unless cache is false.
+    """
+
+    arraysize = 256
+
+    def __init__(self, db, columns, tables, criteria, distinct, group_by=(),
+                 order_by=(), limit=None, offset=None, joins=(), cache=True):
         DbObject.__init__(self, db)
         self.columns = columns
-        self.cursor = self.db.driver.select(
-            tables, criteria, columns, distinct)
+        self.tables = tables
+        self.criteria = criteria
+        self.distinct = distinct
+        self.group_by = group_by
+        self.order_by = order_by
+        self.limit = limit
+        self.offset = offset
+        self.joins = joins
+        self.cache = cache
+
+    def derive(self, **changes):
+        """
+        Return a copy of this selection with some of its attributes changed.
+        """
+        attributes = dict(
+            columns=self.columns, tables=self.tables, criteria=self.criteria,
+            distinct=self.distinct, group_by=self.group_by,
+            order_by=self.order_by, limit=self.limit, offset=self.offset,
+            joins=self.joins, cache=self.cache)
+        attributes.update(changes)
+        return Selection(self.db, **attributes)
+
+    @property
+    def row_class(self):
+        return row_class(tuple(
+            column.name if isinstance(column, Column) else None
+            for column in self.columns))
+
+    @property
+    def make_row(self):
+        """
+        Function converting a row from the database to a Row, with values
+        of the datatypes of the selected columns.
+        """
+        try:
+            return self.__dict__['make_row']
+        except KeyError:
+            make_row = self.__dict__['make_row'] = self.db.driver.decoder(
+                (getattr(column, 'datatype', DataType)
+                 for column in self.columns),
+                partial(tuple.__new__, self.row_class))
+            return make_row
+
+    def execute(self):
+        return self.db.driver.select(
+            self.tables, self.criteria, self.columns, self.distinct,
+            group_by=self.group_by, order_by=self.order_by,
+            limit=self.limit, offset=self.offset, joins=self.joins)
+
+    def statement(self):
+        """
+        Returns the statement and values executed to select the rows.
+        """
+        return self.db.driver.select_statement(
+            self.tables, self.criteria, self.columns, self.distinct,
+            group_by=self.group_by, order_by=self.order_by,
+            limit=self.limit, offset=self.offset, joins=self.joins)
+
+    def fetch(self, size=None):
+        """
+        Iterate over lists of at most size rows, as returned by the database.
+        """
+        size = size or self.arraysize
+        cache = self.db.result_cache if self.cache else None
+        if cache is not None:
+            try:
+                statement, values = self.statement()
+            except NotImplementedError:
+                cache = None
+        if cache is not None:
+            key = (statement, tuple(sorted(values.items())
+                                    if isinstance(values, dict) else values))
+            versions = table_versions(self.tables)
+            rows = cache.lookup(key, versions)
+            if rows is not None:
+                for start in range(0, len(rows), size):
+                    yield rows[start:start + size]
+                return
+            results = []
+            for rows in self.fetch_from_database(size):
+                results.extend(rows)
+                yield rows
+            cache.store(key, versions, results)
+        else:
+            yield from self.fetch_from_database(size)
+
+    def chunks(self):
+        """
+        Returns selections which together select the same rows as this one,
+        each of which binds no more values than the driver's
+        parameter_limit.
+
+        Only the largest IN test which all rows must pass is split, and
+        only if the rows are neither ordered, limited, grouped nor distinct,
+        and no aggregate is selected. Otherwise this selection is returned
+        alone.
+        """
+        limit = self.db.driver.parameter_limit
+        if (limit is None or self.distinct or self.group_by or
+                self.order_by or self.limit is not None or
+                self.offset is not None or
+                not all(isinstance(column, Column)
+                        for column in self.columns)):
+            return [self]
+        test = max(membership_tests(self.criteria),
+                   key=lambda test: len(test.arguments), default=None)
+        if test is None:
+            return [self]
+        try:
+            statement, values = self.statement()
+        except NotImplementedError:
+            return [self]
+        if len(values) <= limit:
+            return [self]
+        expression, members = test.arguments[0], test.arguments[1:]
+        size = limit - (len(values) - len(members))
+        if size < 1:
+            return [self]
+        # A value repeated in two chunks would select its rows twice
+        members = tuple(OrderedDict.fromkeys(members))
+        return [
+            self.derive(criteria=replace_conjunct(
+                self.criteria, test, expression.in_(
+                    members[start:start + size])))
+            for start in range(0, len(members), size)]
+
+    def fetch_from_database(self, size):
+        check = self.db.full_scan_check
+        for selection in self.chunks():
+            if check is not None:
+                check(selection)
+            with self.db.driver.connected():
+                cursor = selection.execute()
+                try:
+                    while True:
+                        rows = cursor.fetchmany(size)
+                        if not rows:
+                            break
+                        yield rows
+                finally:
+                    cursor.close()
+
+    def batches(self, size=None):
+        """
+        Iterate over lists of at most size rows.
+        """
+        make_row = self.make_row
+        for rows in self.fetch(size):
+            yield list(map(make_row, rows))
+
+    def iter(self, arraysize=None):
+        """
+        Iterate over rows, fetching arraysize of them at a time.
+        """
+        for rows in self.batches(arraysize):
+            yield from rows
 
     def __iter__(self):
-        for row in self.cursor:
-            yield row
+        return self.iter()
 
     def __repr__(self):
         return "<Selection({})>".format(", ".join(
-            repr(column) for column in self.columns if not column.implicit))
+            repr(column) for column in self.columns
+            if not getattr(column, 'implicit', False)))
 
     def one(self):
-        for row in self:
+        for row in self.iter(arraysize=1):
             return row
         return None
 
+    def explain(self):
+        """
+        Returns the QueryPlan the database would follow to select the rows.
+        """
+        statement, values = self.statement()
+        return self.db.driver.explain(statement, values, self.tables)
+
+    def to_columns(self, arraysize=None):
+        """
+        Return a Row of the values of each selected column.
+
+        Values of Integer and Float columns are collected in array.array
+        buffers of 64-bit integers and doubles, and others in lists. A column
+        containing NULLs, or values which don't fit its buffer, is collected
+        in a list instead. Rows are fetched and transposed arraysize at a
+        time.
+        """
+        driver = self.db.driver
+        datatypes = [getattr(column, 'datatype', DataType)
+                     for column in self.columns]
+        decoders = [driver.deserializer(datatype) for datatype in datatypes]
+        buffers = [array.array(datatype.array_typecode)
+                   if datatype.array_typecode else []
+                   for datatype in datatypes]
+        for rows in self.fetch(arraysize):
+            for index, values in enumerate(zip(*rows)):
+                decode = decoders[index]
+                if decode is not None:
+                    values = [None if value is None else decode(value)
+                              for value in values]
+                buffer = buffers[index]
+                if isinstance(buffer, array.array):
+                    length = len(buffer)
+                    try:
+                        buffer.extend(values)
+                        continue
+                    except (TypeError, OverflowError):
+                        buffer = buffers[index] = buffer[:length].tolist()
+                buffer.extend(values)
+        return self.row_class._make(buffers)
+
+    def to_numpy(self, arraysize=None):
+        """
+        Return the selection as a NumPy structured array.
+
+        Fields are named after the selected columns, and have the types of
+        the buffers returned by to_columns(), or object for lists. Raises
+        ImportError if NumPy isn't installed.
+        """
+        import numpy
+        columns = self.to_columns(arraysize)
+        result = numpy.empty(len(columns[0]), dtype=[
+            (name, buffer.typecode if isinstance(buffer, array.array)
+             else object)
+            for name, buffer in zip(columns._fields, columns)])
+        for name, buffer in zip(columns._fields, columns):
+            result[name] = buffer
+        return result
+
+    def pages(self, key, size):
+        """
+        Iterate over lists of at most size rows, in ascending order of key.
+
+        Each page is selected by its position after the last key of the
+        previous page rather than by OFFSET, so reading a page costs the
+        same wherever it is. Key must be unique among the selected rows. It
+        is selected too, if it isn't one of the selection's columns, but
+        omitted from the rows returned.
+        """
+        columns = list(self.columns)
+        for index, column in enumerate(columns):
+            if column is key:
+                extra = False
+                break
+        else:
+            index = len(columns)
+            columns.append(key)
+            extra = True
+        last = None
+        while True:
+            criteria = self.criteria
+            if last is not None:
+                after = (key > last)
+                criteria = after if criteria is None else (criteria & after)
+            rows = list(self.derive(
+                columns=columns, tables=self.tables | key.tables,
+                criteria=criteria, order_by=(key,), limit=size, offset=None,
+            ).iter(arraysize=size))
+            if not rows:
+                return
+            last = rows[-1][index]
+            if extra:
+                rows = [self.row_class._make(row[:-1]) for row in rows]
+            yield rows
+            if len(rows) < size:
+                return
+
+    def count(self):
+        """
+        Return the number of rows in the selection, counted by the database.
+
+        Grouped and limited selections, those of distinct rows of more than
+        one column, and those of expressions such as aggregates, are counted
+        by selecting from the selection.
+        """
+        if (self.group_by or self.limit is not None or
+                self.offset is not None or
+                (self.distinct and len(self.columns) != 1) or
+                not all(isinstance(column, Column)
+                        for column in self.columns)):
+            selection = (self if self.limit is not None or
+                         self.offset is not None
+                         else self.derive(order_by=()))
+            statement, values = selection.statement()
+            return self.db.driver.count_rows(statement, values)
+        if not self.distinct:
+            counter = Filter(self.db, 'COUNTALL')
+        else:
+            counter = Filter(self.db, 'COUNTDISTINCT', self.columns[0])
+        return sum(
+            chunk.derive(columns=[counter], distinct=False,
+                         order_by=()).one()[0]
+            for chunk in self.derive(order_by=()).chunks())
+
 
 class Selectable(DbObject):
     def __init__(self, db, tables):
@@ -44,44 +473,352 @@ class Selectable(DbObject):
                              "got {!r}").format(type(tables)))
         self.tables = tables
 
+    # Filter which rows must match, if any
+    criteria = None
+
+    # Tables joined explicitly, as (kind, table, condition) tuples. The first
+    # is the table the others are joined to, and its kind and condition are
+    # None.
+    joins = ()
+
+    def default_columns(self):
+        """
+        Returns the columns selected when none are specified.
+        """
+        return [column for table in self.tables for column in table.columns
+                if not column.implicit]
+
     def select(self, *columns, **kwargs):
+        """
+        Select columns of rows from this table or matching this filter.
+
+        Columns may be any expression, including aggregate functions, in
+        which case group_by may list the expressions to aggregate over.
+        All columns of the tables involved are selected if none are given.
+
+        Rows are sorted by the expressions in order_by; use their desc()
+        method to reverse the order. At most limit rows are returned, after
+        skipping the first offset.
+
+        Pass cache=False to always read the rows from the database, even if
+        the DB caches results.
+        """
         distinct = kwargs.pop('distinct', False)
+        cache = kwargs.pop('cache', True)
+        group_by = kwargs.pop('group_by', ())
+        order_by = kwargs.pop('order_by', ())
+        limit = kwargs.pop('limit', None)
+        offset = kwargs.pop('offset', None)
         if kwargs:
             raise TypeError("select() got an unexpected keyword argument "
                             "{!r}".format(kwargs.popitem()[0]))
 
+        tables = set(self.tables)
         if not columns:
-            columns = []
-            for table in self.tables:
-                for column in table.columns:
-                    if not column.implicit:
-                        columns.append(column)
+            columns = self.default_columns()
+        else:
+            columns = list(columns)
+            for column in columns:
+                if isinstance(column, Filter):
+                    tables.update(column.tables)
+        if isinstance(group_by, Filter):
+            group_by = (group_by,)
+        if isinstance(order_by, Filter):
+            order_by = (order_by,)
+        check_cartesian_product(tables, self.criteria, self.joins)
         return Selection(
-            self.db, columns, self.tables,
-            self if isinstance(self, Filter) else None,
-            distinct,
+            self.db, columns, tables, self.criteria,
+            distinct, group_by=tuple(group_by), order_by=tuple(order_by),
+            limit=limit, offset=offset, joins=self.joins, cache=cache,
         )
 
     def select_all(self, *columns, **kwargs):
         return list(self.select(*columns, **kwargs))
 
+    def explain(self, *columns, **kwargs):
+        """
+        Returns the QueryPlan for select() with the same arguments.
+        """
+        return self.select(*columns, **kwargs).explain()
+
     def update(self, **values):
+        """
+        Set values in the rows of this table or matching this filter.
+        """
         if len(self.tables) != 1:
             raise ValueError("Can only update one table at a time")
-        self.db.driver.update(
-            list(self.tables)[0],
-            self if isinstance(self, Filter) else None,
-            values,
-        )
+        table, = self.tables
+        try:
+            self.db.driver.update(table, self.criteria, values)
+        finally:
+            table.clear_row_cache()
 
-    def delete(self):
-        self.db.driver.delete(
-            self.tables,
-            self if isinstance(self, Filter) else None,
-        )
+    def update_in_batches(self, values, batch_size, pause=None,
+                          progress=None):
+        """
+        Set values, a mapping of column names to new values, in the rows of
+        this table or matching this filter, in batches as described for
+        change_in_batches(). Returns the number of rows updated.
+
+        Values are given as a mapping, rather than as keyword arguments as
+        for update(), so that columns may share the names of the other
+        arguments.
+
+        >>> import dibi
+
+        >>> db = dibi.DB.connect('sqlite')
+
+        >>> jobs = db.add_table('jobs')
+
+        >>> _ = jobs.add_column('pause', Integer)
+
+        >>> jobs.save()
+
+        >>> jobs.insert_many([dict(pause=0) for _ in range(5)])
+        5
+
+        >>> jobs.update_in_batches(dict(pause=1), 2, progress=print)
+        2
+        4
+        5
+        5
+
+        >>> (jobs.pause == 1).select().count()
+        5
+        """
+        if len(self.tables) != 1:
+            raise ValueError("Can only update one table at a time")
+        table, = self.tables
+        return self.change_in_batches(
+            lambda criteria: self.db.driver.update(table, criteria, values),
+            batch_size, pause, progress)
+
+    def delete(self, batch_size=None, pause=None, progress=None):
+        """
+        Delete the rows of this table or matching this filter.
+
+        If batch_size is given, rows are deleted in batches, as described
+        for change_in_batches(), and the number deleted is returned.
+
+        >>> import dibi
+
+        >>> db = dibi.DB.connect('sqlite')
+
+        >>> events = db.add_table('events')
+
+        >>> _ = events.add_column('day', Integer)
+
+        >>> events.save()
+
+        >>> events.insert_many([dict(day=day) for day in range(10)])
+        10
+
+        >>> (events.day < 7).delete(batch_size=3, progress=print)
+        3
+        6
+        7
+        7
+
+        >>> events.count()
+        3
+        """
+        if batch_size is not None:
+            return self.change_in_batches(
+                lambda criteria: self.db.driver.delete(self.tables, criteria),
+                batch_size, pause, progress)
+        try:
+            self.db.driver.delete(self.tables, self.criteria)
+        finally:
+            for table in self.tables:
+                table.clear_row_cache()
+
+    def change_in_batches(self, change, batch_size, pause=None,
+                          progress=None):
+        """
+        Call change with criteria matching batch_size rows at a time, in
+        order of primary key, and return the number of rows matched.
+
+        Each batch is changed in a transaction of its own, so that other
+        writers wait at most for one batch rather than for every row,
+        unless this is called within an enclosing transaction. Between
+        batches, progress is called with the number of rows changed so far
+        if given, then the next batch waits for pause seconds.
+        """
+        if len(self.tables) != 1:
+            raise ValueError("Can only change one table in batches")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        table, = self.tables
+        key = table.__dict__['primarykey']
+        count = 0
+        for page in self.select(key, cache=False).pages(key, batch_size):
+            criteria = key.between(page[0][0], page[-1][0])
+            if self.criteria is not None:
+                criteria = self.criteria & criteria
+            try:
+                with self.db.transaction():
+                    change(criteria)
+            finally:
+                table.clear_row_cache()
+            count += len(page)
+            if progress is not None:
+                progress(count)
+            if pause and len(page) == batch_size:
+                time.sleep(pause)
+        return count
 
     def count(self):
-        raise NotImplementedError
+        """
+        Return the number of rows, counted by the database.
+
+        Filters use count() for the aggregate function, so use
+        select().count() to count the rows matching a filter.
+        """
+        return self.select().count()
+
+    def join(self, other, on=None, kind='inner'):
+        """
+        Join another table to this one.
+
+        Kind is 'inner', 'left' or 'cross'. Rows are paired where the
+        expression on is true, except for cross joins, which pair every row
+        with every other and take no condition.
+        """
+        tables = [table for table in self.tables if table not in {other}]
+        if len(tables) != 1:
+            raise ValueError("Can only join to a single table")
+        return Join(self.db, tables[0], criteria=self.criteria).join(
+            other, on, kind)
+
+
+def check_cartesian_product(tables, criteria, joins):
+    """
+    Warn if tables aren't all related to each other, by being joined or by
+    an expression in criteria which involves more than one of them.
+    """
+    if len(tables) < 2:
+        return
+    groups = {table: {table} for table in tables}
+
+    def relate(related):
+        related = set(related) & set(groups)
+        merged = set().union(*(groups[table] for table in related))
+        for table in merged:
+            groups[table] = merged
+
+    for kind, table, condition in joins[1:]:
+        relate({joins[0][1], table} if kind == 'cross' else
+               {table} | condition.tables)
+    conditions = [criteria] if criteria is not None else []
+    while conditions:
+        condition = conditions.pop()
+        if isinstance(condition, Filter) and condition.operator == 'AND':
+            conditions.extend(condition.arguments)
+        elif isinstance(condition, Filter):
+            relate(condition.tables)
+    if len(set(map(frozenset, groups.values()))) > 1:
+        warnings.warn(
+            "Selecting from unrelated tables {} produces every combination "
+            "of their rows. Join them with a condition, or explicitly with "
+            "kind='cross'".format(", ".join(sorted(
+                repr(table.name) for table in tables))),
+            CartesianProductWarning, stacklevel=3)
+
+
+class Join(Selectable):
+    """
+    Tables combined by JOIN clauses.
+
+    >>> import dibi
+
+    >>> db = dibi.DB.connect('sqlite')
+
+    >>> a = db.add_table('a', primarykey='id')
+
+    >>> b = db.add_table('b', primarykey='id')
+
+    >>> _ = b.add_column('a_id', Integer)
+
+    >>> a.save(); b.save()
+
+    >>> list(a.join(b, on=(a.id == b.a_id), kind='left').select(b.a_id))
+    []
+
+    >>> print(db.driver.last_statement)
+    SELECT "b"."a_id" FROM "a" LEFT JOIN "b" ON ("a"."id"="b"."a_id");
+    """
+
+    kinds = ('inner', 'left', 'cross')
+
+    # Shadows Selectable.criteria, so that it may be set on instances
+    criteria = None
+
+    def __init__(self, db, table, joins=(), criteria=None):
+        self.joins = ((None, table, None),) + tuple(joins)
+        self.criteria = criteria
+        Selectable.__init__(self, db, {join[1] for join in self.joins})
+
+    def __repr__(self):
+        return "Join({})".format(", ".join(
+            repr(table.name) for kind, table, on in self.joins))
+
+    def default_columns(self):
+        return [column for kind, table, on in self.joins
+                for column in table.columns if not column.implicit]
+
+    def join(self, other, on=None, kind='inner'):
+        if kind not in self.kinds:
+            raise ValueError("Unknown kind of join {!r}".format(kind))
+        if (on is None) != (kind == 'cross'):
+            raise ValueError("Only cross joins may omit a condition")
+        if other in self.tables:
+            raise ValueError("{!r} is already joined".format(other))
+        return Join(self.db, self.joins[0][1],
+                    self.joins[1:] + ((kind, other, on),), self.criteria)
+
+    def where(self, criteria):
+        """
+        Return a copy of this join restricted to rows matching criteria.
+        """
+        if self.criteria is not None:
+            criteria = self.criteria & criteria
+        return Join(self.db, self.joins[0][1], self.joins[1:], criteria)
+
+    def update(self, **values):
+        raise TypeError("Can't update joined tables")
+
+    def update_in_batches(self, values, batch_size, pause=None,
+                          progress=None):
+        raise TypeError("Can't update joined tables")
+
+    def delete(self):
+        raise TypeError("Can't delete from joined tables")
+
+
+def membership_tests(criteria):
+    """
+    Iterate over the IN tests which rows must pass to match criteria.
+    """
+    operator = getattr(criteria, 'operator', None)
+    if operator == 'IN':
+        yield criteria
+    elif operator == 'AND':
+        for argument in criteria.arguments:
+            yield from membership_tests(argument)
+
+
+def replace_conjunct(criteria, old, new):
+    """
+    Returns criteria with the test old, which rows must pass, replaced by
+    new.
+    """
+    if criteria is old:
+        return new
+    elif getattr(criteria, 'operator', None) == 'AND':
+        return Filter(criteria.db, 'AND', *(
+            replace_conjunct(argument, old, new)
+            for argument in criteria.arguments))
+    return criteria
 
 
 def operator(identifier, order=2, reverse=False):
@@ -102,9 +839,18 @@ class Filter(Selectable):
     def __init__(self, db, operator, *arguments):
         self.operator = operator
         self.arguments = arguments
-        tables = set(arg.table for arg in arguments if isinstance(arg, Column))
+        tables = set()
+        for arg in arguments:
+            if isinstance(arg, Column):
+                tables.add(arg.table)
+            elif isinstance(arg, Filter):
+                tables.update(arg.tables)
         Selectable.__init__(self, db, tables)
 
+    @property
+    def criteria(self):
+        return self
+
     def __repr__(self):
         return 'Filter({}, {})'.format(
             repr(self.operator),
@@ -126,6 +872,21 @@ class Filter(Selectable):
     __lt__ = operator('LESSTHAN')
     __le__ = operator('LESSEQUAL')
 
+    def in_(self, values):
+        """
+        Test for equality with any of values.
+
+        Selections testing more values than the driver can bind in one
+        statement are split into several, where possible.
+        """
+        return Filter(self.db, 'IN', self, *values)
+
+    def not_in(self, values):
+        return Filter(self.db, 'NOTIN', self, *values)
+
+    def between(self, low, high):
+        return Filter(self.db, 'BETWEEN', self, low, high)
+
     # Mathematical operators
 
     def __add__(self, other):
@@ -151,6 +912,11 @@ class Filter(Selectable):
     min = operator('MINIMUM', order=1)
     count = operator('COUNT', order=1)
 
+    # Sort order
+
+    asc = operator('ASCENDING', order=1)
+    desc = operator('DESCENDING', order=1)
+
 
 class Column(Filter):
     def __init__(self, db, table, name, datatype, primarykey, autoincrement,
@@ -172,16 +938,56 @@ class Column(Filter):
         return "{!r}.{!r}".format(self.table.name, self.name)
 
 
+class Index(DbObject):
+    def __init__(self, db, table, name, columns, unique):
+        DbObject.__init__(self, db)
+        self.table = table
+        self.name = name
+        self.columns = tuple(columns)
+        self.unique = unique
+
+    def __repr__(self):
+        return "Index({!r}, {}{})".format(
+            self.name, ", ".join(repr(column) for column in self.columns),
+            ", unique=True" if self.unique else "")
+
+    def save(self, force_create=False):
+        self.db.driver.create_index(self.table, self, force_create)
+
+    def drop(self, ignore_absence=True):
+        self.db.driver.drop_index(self.table, self, ignore_absence)
+        self.table.indexes.discard(self)
+
+
 class Table(Selectable):
+    # Rows recently retrieved by primary key, if enabled by cache_rows()
+    row_cache = None
+
     def __init__(self, db, name, primarykey=None):
         self.name = name
         Selectable.__init__(self, db, {self})
         self.columns = OrderedCollection(lambda col: col.name)
+        self.indexes = OrderedCollection(lambda index: index.name)
         self.primarykey = None
         if primarykey is not None:
             self.primarykey = self.add_column(
                 primarykey, Integer, primarykey=True, autoincrement=True)
 
+    @property
+    def version(self):
+        """
+        Incremented by the driver whenever the table is changed.
+
+        Versions are kept by the DB for each table name, so a table dropped
+        and created again, or replaced by reflection, never returns to an
+        earlier version.
+        """
+        return self.db.table_versions.get(self.name, 0)
+
+    @version.setter
+    def version(self, version):
+        self.db.table_versions[self.name] = version
+
     def __hash__(self):
         return hash(self.name)
 
@@ -200,6 +1006,42 @@ class Table(Selectable):
             self.primarykey = column
         return column
 
+    def add_index(self, *columns, **kwargs):
+        """
+        Declare an index on columns, given as Columns or by name.
+
+        Indexes are created with the table by save(), or individually by
+        their own save() method if the table already exists. If no name is
+        given, one is made from the names of the table and columns.
+        """
+        unique = kwargs.pop('unique', False)
+        name = kwargs.pop('name', None)
+        if kwargs:
+            raise TypeError("add_index() got an unexpected keyword argument "
+                            "{!r}".format(kwargs.popitem()[0]))
+        if not columns:
+            raise NoColumnsError("Cannot create index with no columns")
+        columns = [self.columns[column] if isinstance(column, str)
+                   else column for column in columns]
+        if any(column.table is not self for column in columns):
+            raise ValueError("Can only index columns of {!r}".format(
+                self.name))
+        if name is None:
+            name = '_'.join([self.name] + [column.name for column in columns]
+                            + ['index'])
+        return self.indexes.add(
+            Index(self.db, self, name, columns, unique), replace=False)
+
+    def drop_index(self, index, ignore_absence=True):
+        """
+        Remove an index, given as an Index or by name.
+        """
+        if isinstance(index, str):
+            index = self.indexes.get(index) or Index(
+                self.db, self, index, (), False)
+        index.table = self
+        index.drop(ignore_absence)
+
     def save(self, force_create=False):
         if not self.columns:
             raise NoColumnsError(
@@ -211,16 +1053,305 @@ class Table(Selectable):
                 '__id__', Integer, primarykey=True, autoincrement=True)
             self.primarykey.implicit = True
         self.db.driver.create_table(self, self.columns, force_create)
+        for index in self.indexes:
+            index.save(force_create)
 
     def drop(self, ignore_absence=True):
         self.db.driver.drop_table(self, ignore_absence)
         self.db.tables.discard(self)
+        self.clear_row_cache()
 
     def insert(self, **values):
-        return self.db.driver.insert(self, values)
+        try:
+            return self.db.driver.insert(self, values)
+        finally:
+            self.clear_row_cache()
+
+    def insert_many(self, rows, batch_size=1000):
+        """
+        Add many rows at once and return the number of rows inserted.
+
+        Rows may be mappings of column names to values, all with the same
+        keys, or sequences of values for each explicit column in order. Rows
+        are consumed lazily and committed batch_size rows at a time.
+        """
+        names, rows = self.row_values(rows)
+        if names is None:
+            return 0
+        try:
+            return self.db.driver.insert_many(self, names, rows, batch_size)
+        finally:
+            self.clear_row_cache()
+
+    def row_values(self, rows):
+        """
+        Returns the column names of rows, given as for insert_many(), and
+        an iterator over tuples of their values. Names is None if there are
+        no rows.
+        """
+        rows = iter(rows)
+        for first in rows:
+            break
+        else:
+            return None, ()
+        rows = chain([first], rows)
+        if isinstance(first, Mapping):
+            names = list(first)
+            rows = (tuple(row[name] for name in names) for row in rows)
+        else:
+            names = [column.name for column in self.columns
+                     if not column.implicit]
+        return names, rows
+
+    def update_many(self, rows, key=None, batch_size=1000):
+        """
+        Apply different changes to many rows, each given as a mapping of
+        column names to new values which includes the value of key to
+        identify the row. Key is a Column or column name, and defaults to
+        the primary key. Returns the number of rows updated.
+
+        Rows changing the same columns are updated by one statement, sent
+        batch_size rows at a time, all within one transaction.
+
+        >>> import dibi
+
+        >>> db = dibi.DB.connect('sqlite')
+
+        >>> table = db.add_table('people', primarykey='id')
+
+        >>> _ = table.add_column('name', Text)
+
+        >>> _ = table.add_column('age', Integer)
+
+        >>> table.save()
+
+        >>> table.insert(name='ann', age=30), table.insert(name='bo')
+        (1, 2)
+
+        >>> table.update_many([dict(id=1, age=31), dict(id=2, name='bob')])
+        2
+
+        >>> table.select_all()
+        [Row(id=1, name='ann', age=31), Row(id=2, name='bob', age=None)]
+        """
+        if key is None:
+            key = self.__dict__['primarykey']
+        key_name = key if isinstance(key, str) else key.name
+        groups = OrderedDict()
+        for row in rows:
+            names = tuple(sorted(name for name in row if name != key_name))
+            if names:
+                groups.setdefault(names, []).append(
+                    tuple(row[name] for name in names) + (row[key_name],))
+        count = 0
+        try:
+            with self.db.driver.transaction():
+                for names, values in groups.items():
+                    count += self.db.driver.update_many(
+                        self, key_name, names, values, batch_size)
+        finally:
+            self.clear_row_cache()
+        return count
+
+    def conflict_names(self, columns):
+        if isinstance(columns, (str, Column)):
+            columns = [columns]
+        names = [column if isinstance(column, str) else column.name
+                 for column in columns]
+        if not names:
+            raise NoColumnsError("Upserts need at least one conflict column")
+        return names
+
+    def upsert(self, conflict_columns, **values):
+        """
+        Insert a row of values, or if a row with the same values of
+        conflict_columns already exists, update it with the other values.
+
+        Conflict_columns, given as Columns or by name, must be covered by
+        the primary key or a unique index. MySQL uses whichever unique key
+        conflicts, regardless of conflict_columns.
+
+        >>> import dibi
+
+        >>> db = dibi.DB.connect('sqlite')
+
+        >>> table = db.add_table('stock')
+
+        >>> _ = table.add_column('sku', Text, primarykey=True)
+
+        >>> _ = table.add_column('count', Integer)
+
+        >>> table.save()
+
+        >>> table.upsert('sku', sku='a1', count=3)
+
+        >>> table.upsert_many(table.sku, [('a1', 5), ('b2', 1)])
+        2
+
+        >>> table.select_all()
+        [Row(sku='a1', count=5), Row(sku='b2', count=1)]
+        """
+        try:
+            self.db.driver.upsert(
+                self, self.conflict_names(conflict_columns), values)
+        finally:
+            self.clear_row_cache()
+
+    def upsert_many(self, conflict_columns, rows, batch_size=1000):
+        """
+        Upsert many rows at once, given as for insert_many(), and return the
+        number of rows sent, whether they were inserted, updated or left
+        unchanged.
+
+        >>> import dibi
+
+        >>> db = dibi.DB.connect('sqlite')
+
+        >>> table = db.add_table('prices')
+
+        >>> _ = table.add_column('sku', Text, primarykey=True)
+
+        >>> _ = table.add_column('cents', Integer)
+
+        >>> table.save()
+
+        >>> table.upsert_many('sku', [('a1', 100), ('b2', 250)])
+        2
+
+        >>> table.upsert_many('sku', [dict(sku='a1', cents=100),
+        ...                           dict(sku='b2', cents=300),
+        ...                           dict(sku='c3', cents=50)], batch_size=2)
+        3
+        """
+        conflict_names = self.conflict_names(conflict_columns)
+        names, rows = self.row_values(rows)
+        if names is None:
+            return 0
+        try:
+            return self.db.driver.upsert_many(
+                self, conflict_names, names, rows, batch_size)
+        finally:
+            self.clear_row_cache()
 
     def __getattr__(self, key):
         return self.columns[key]
 
+    def cache_rows(self, maxsize=128, ttl=None):
+        """
+        Remember up to maxsize rows retrieved by primary key, for at most ttl
+        seconds if given. Returns the LRUCache holding them, which counts
+        hits, misses and evictions.
+
+        The cache is cleared whenever rows are inserted, updated or deleted
+        by dibi, but not when the table is changed by other means.
+
+        >>> import dibi
+
+        >>> db = dibi.DB.connect('sqlite')
+
+        >>> table = db.add_table('settings', primarykey='id')
+
+        >>> _ = table.add_column('value', Text)
+
+        >>> table.save()
+
+        >>> cache = table.cache_rows()
+
+        >>> table.insert(value='a')
+        1
+
+        >>> table[1], table[1]
+        (Row(id=1, value='a'), Row(id=1, value='a'))
+
+        >>> cache.hits, cache.misses
+        (1, 1)
+
+        >>> table.update(value='b')
+
+        >>> table[1]
+        Row(id=1, value='b')
+        """
+        self.row_cache = LRUCache(maxsize, ttl)
+        return self.row_cache
+
+    def clear_row_cache(self):
+        if self.row_cache is not None:
+            self.row_cache.clear()
+
+    def forget_stale_rows(self, version):
+        """
+        Clear the row cache if the table has changed since version, as rows
+        just cached may have been read before the change.
+
+        Drivers change the version before clearing the cache, so a row
+        cached before this check is cleared by one or the other.
+        """
+        if self.version != version:
+            self.clear_row_cache()
+
     def __getitem__(self, key):
-        return (self.__dict__['primarykey'] == key).select().one()
+        cache = self.row_cache
+        if cache is not None:
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+        version = self.version
+        row = (self.__dict__['primarykey'] == key).select().one()
+        if cache is not None:
+            cache[key] = row
+            self.forget_stale_rows(version)
+        return row
+
+    def get_many(self, keys):
+        """
+        Returns a dict of the rows whose primary keys are among keys, keyed
+        by primary key. Keys of missing rows are left out.
+
+        Rows are selected together, in as few statements as the driver's
+        parameter_limit allows.
+
+        >>> import dibi
+
+        >>> db = dibi.DB.connect('sqlite')
+
+        >>> table = db.add_table('users', primarykey='id')
+
+        >>> _ = table.add_column('name', Text)
+
+        >>> table.save()
+
+        >>> for name in ('ann', 'bob', 'cy'):
+        ...     _ = table.insert(name=name)
+
+        >>> table.get_many([3, 1, 7])
+        {1: Row(id=1, name='ann'), 3: Row(id=3, name='cy')}
+        """
+        primarykey = self.__dict__['primarykey']
+        rows = {}
+        missing = []
+        cache = self.row_cache
+        for key in OrderedDict.fromkeys(keys):
+            if cache is not None:
+                try:
+                    row = cache[key]
+                except KeyError:
+                    pass
+                else:
+                    if row is not None:
+                        rows[key] = row
+                    continue
+            missing.append(key)
+        if missing:
+            version = self.version
+            columns = self.default_columns()
+            make_row = partial(tuple.__new__, row_class(
+                tuple(column.name for column in columns)))
+            for key, *values in primarykey.in_(missing).select(
+                    primarykey, *columns):
+                rows[key] = make_row(values)
+            if cache is not None:
+                for key in missing:
+                    cache[key] = rows.get(key)
+                self.forget_stale_rows(version)
+        return rows
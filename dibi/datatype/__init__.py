@@ -1,8 +1,13 @@
 
 import datetime
+import numbers
 
 
 class DataType(object):
+    # array.array typecode of a buffer able to hold values of this type, if
+    # any
+    array_typecode = None
+
     @staticmethod
     def serialize(value):
         return value
@@ -15,39 +20,93 @@ class DataType(object):
 class Text(DataType):
     database_type = 'TEXT'
     database_size = 512
-    serialize = str
     deserialize = str
 
+    @staticmethod
+    def serialize(value):
+        """
+        Numbers are stored as their text. Anything else which isn't already
+        text, such as bytes, is refused rather than stored as its repr.
+
+        >>> Text.serialize(2)
+        '2'
+
+        >>> Text.serialize(b'abc')
+        Traceback (most recent call last):
+         ...
+        TypeError: Expected text, got bytes
+        """
+        if isinstance(value, str):
+            return value
+        elif isinstance(value, numbers.Number) and not isinstance(
+                value, bool):
+            return str(value)
+        raise TypeError("Expected text, got {}".format(type(value).__name__))
+
 
 class Integer(DataType):
     database_type = 'INT'
     database_size = 64
-    serialize = int
+    array_typecode = 'q'
+
+    @staticmethod
+    def serialize(value):
+        """
+        Values are converted to int only if that doesn't change them.
+
+        >>> Integer.serialize(2.0), Integer.serialize('3')
+        (2, 3)
+
+        >>> Integer.serialize(2.7)
+        Traceback (most recent call last):
+         ...
+        ValueError: 2.7 is not an integer
+        """
+        if isinstance(value, (bytes, bytearray)):
+            raise TypeError("Expected an integer, got {}".format(
+                type(value).__name__))
+        integer = int(value)
+        if not isinstance(value, str) and integer != value:
+            raise ValueError("{!r} is not an integer".format(value))
+        return integer
 
 
 class Date(Text):
     @staticmethod
     def serialize(value):
+        """
+        Dates are stored in ISO format. Text is checked and normalized.
+
+        >>> Date.serialize(datetime.date(2024, 1, 2))
+        '2024-01-02'
+        """
+        if isinstance(value, str):
+            value = datetime.date.fromisoformat(value)
         return value.isoformat()
 
-    @staticmethod
-    def deserialize(value):
-        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    deserialize = datetime.date.fromisoformat
 
 
 class DateTime(Text):
     @staticmethod
     def serialize(value):
+        """
+        Datetimes are stored in ISO format. Text is checked and normalized.
+
+        >>> DateTime.serialize('2024-01-02 03:04:05')
+        '2024-01-02T03:04:05'
+        """
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
         return value.isoformat()
 
-    @staticmethod
-    def deserialize(value):
-        return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f")
+    deserialize = datetime.datetime.fromisoformat
 
 
 class Float(DataType):
     database_type = 'REAL'
     database_size = 64
+    array_typecode = 'd'
 
 
 class Blob(DataType):
@@ -57,3 +116,69 @@ class Blob(DataType):
 
 class AutoIncrement(Integer):
     database_size = 64
+
+
+identity = DataType.deserialize
+
+
+def named(name):
+    """
+    Returns the DataType subclass called name.
+
+    >>> named('Integer') is Integer
+    True
+    """
+    if name == DataType.__name__:
+        return DataType
+    subclasses = DataType.__subclasses__()
+    while subclasses:
+        datatype = subclasses.pop()
+        if datatype.__name__ == name:
+            return datatype
+        subclasses.extend(datatype.__subclasses__())
+    raise ValueError("No datatype named {!r}".format(name))
+
+
+def converter(functions, factory=None):
+    """
+    Compile a function which applies functions to the items of a row.
+
+    Items whose function is None or the identity are passed through, as are
+    None values. The converted items are passed as a tuple to factory, if
+    given. If no items need converting, factory (which may be None) is
+    returned instead.
+
+    >>> convert = converter([None, int, identity])
+
+    >>> convert(('a', '1', 2.5))
+    ('a', 1, 2.5)
+
+    >>> convert(['a', None, 2.5])
+    ('a', None, 2.5)
+
+    >>> converter([identity, None]) is None
+    True
+
+    >>> converter([str], factory=list)((1,))
+    ['1']
+    """
+    functions = [None if function is identity else function
+                 for function in functions]
+    if not any(functions):
+        return factory
+    namespace = {'factory': factory}
+    names = []
+    items = []
+    for index, function in enumerate(functions):
+        name = 'v{}'.format(index)
+        names.append(name)
+        if function is None:
+            items.append(name)
+        else:
+            namespace['f{}'.format(index)] = function
+            items.append('None if {0} is None else f{1}({0})'.format(
+                name, index))
+    exec('def convert(row):\n    {}, = row\n    return {}(({},))\n'.format(
+        ', '.join(names), 'factory' if factory else '', ', '.join(items)),
+        namespace)
+    return namespace['convert']
@@ -1,12 +1,13 @@
+"""
+Drivers by name. Each is imported the first time it is requested, so that
+the dependencies of unused drivers are never loaded.
+"""
 
 from . import common
-from . import sqlite
-
-try:
-    from . import mysql
-except ImportError:
-    pass
 
 registry = common.registry
 
-get = common.registry.__getitem__
+registry.add('sqlite', 'dibi.driver.sqlite')
+registry.add('mysql', 'dibi.driver.mysql')
+
+get = registry.__getitem__
@@ -1,11 +1,25 @@
 #!/usr/bin/env python
 
+from ..collection import LRUCache
 from ..common import Column, Filter
-from ..error import NoSuchTableError
+from ..datatype import DataType, converter, identity
+from ..error import (NoSuchTableError, NonTransactionalWarning,
+                     UnknownTypeWarning)
+from .instrumentation import Execution, InstrumentedCursor
+from .pool import SingleConnection, ConnectionPool
 
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from collections.abc import Mapping
 from contextlib import contextmanager
+from importlib import import_module
+from itertools import islice
+import datetime
 import logging
+import math
+import threading
+import time
+import warnings
 
 
 class CleanSQL(str):
@@ -58,9 +72,42 @@ C = CleanSQL
 
 
 class Driver(metaclass=ABCMeta):
+    # Types of value the database returns without help. Deserializers which
+    # are one of these types are skipped.
+    native_types = (str,)
+
+    # Most values which may be bound to one statement, or None if there is
+    # no limit
+    parameter_limit = None
+
     def __init__(self):
         self.features = set()
 
+    def decoder(self, datatypes, factory=None):
+        """
+        Returns a function converting rows of values of datatypes from the
+        database and passing them to factory. If they need no conversion,
+        factory is returned instead.
+        """
+        return converter(map(self.deserializer, datatypes), factory)
+
+    def deserializer(self, datatype):
+        """
+        Returns the function converting a value of datatype from the
+        database, or None if it needs no conversion.
+        """
+        if (datatype.deserialize in self.native_types or
+                datatype.deserialize is identity):
+            return None
+        return datatype.deserialize
+
+    def encoder(self, datatypes):
+        """
+        Returns a function converting rows of values of datatypes for the
+        database, or None if they need no conversion.
+        """
+        return converter(datatype.serialize for datatype in datatypes)
+
     @abstractmethod
     def handle_exception(self, error):
         """
@@ -86,6 +133,24 @@ class Driver(metaclass=ABCMeta):
         """
         return
 
+    @contextmanager
+    def connected(self):
+        """
+        Reserve a connection for the current thread until the block exits.
+
+        Drivers which share connections between threads must override this.
+        """
+        yield
+
+    @contextmanager
+    def transaction(self, savepoint=True):
+        """
+        Group statements executed within the block into one transaction.
+
+        Drivers which support transactions must override this.
+        """
+        yield self
+
     # Table schema methods
 
     @abstractmethod
@@ -154,6 +219,68 @@ class Driver(metaclass=ABCMeta):
         """
         raise NotImplementedError
 
+    # Index schema methods
+
+    def create_index(self, table, index, force_create):
+        """
+        Add an index on some of a table's columns.
+
+        This method is an optional extension. It should be implemented if
+        possible, but its absence does not prevent normal operation.
+        """
+        raise NotImplementedError
+
+    def list_indexes(self, table_name):
+        """
+        Returns a list of (name, column names, unique) for each index on a
+        table, excluding its primary key.
+
+        This method is an optional extension. It should be implemented if
+        possible, but its absence does not prevent normal operation.
+        """
+        raise NotImplementedError
+
+    def unknown_type(self, database_type):
+        """
+        Returns the datatype of columns of a database type with no
+        counterpart, whose values are used as the database returns them,
+        and warns with UnknownTypeWarning.
+        """
+        warnings.warn("Unknown column type {!r} is read without "
+                      "conversion".format(database_type), UnknownTypeWarning,
+                      stacklevel=2)
+        return DataType
+
+    def reflect(self, names=None):
+        """
+        Returns (name, columns, indexes) for each of the named tables, or
+        for every table if names is None. Columns and indexes are as
+        returned by list_columns() and list_indexes().
+
+        This implementation queries each table separately. Drivers should
+        override it to discover all tables at once.
+        """
+        if names is None:
+            names = list(self.list_tables())
+        tables = []
+        for name in names:
+            columns = list(self.list_columns(name))
+            try:
+                indexes = self.list_indexes(name)
+            except NotImplementedError:
+                indexes = []
+            tables.append((name, columns, indexes))
+        return tables
+
+    def drop_index(self, table, index, ignore_absence):
+        """
+        Remove an index from a table.
+
+        This method is an optional extension. It should be implemented if
+        possible, but its absence does not prevent normal operation.
+        """
+        raise NotImplementedError
+
     # Row/object methods
 
     @abstractmethod
@@ -163,13 +290,100 @@ class Driver(metaclass=ABCMeta):
         """
         return
 
+    def insert_many(self, table, names, rows, batch_size):
+        """
+        Add rows of values for names to table. Returns the number of rows
+        inserted.
+
+        The default implementation inserts each row individually. Drivers
+        should override it to send rows in batches of batch_size.
+        """
+        count = 0
+        for row in rows:
+            self.insert(table, dict(zip(names, row)))
+            count += 1
+        return count
+
+    def upsert(self, table, conflict_names, values):
+        """
+        Add a row of values to table, or if it conflicts with an existing
+        row on the columns named by conflict_names, update that row with
+        the other values instead.
+
+        This method is an optional extension. It should be implemented if
+        possible, but its absence does not prevent normal operation.
+        """
+        raise NotImplementedError
+
+    def upsert_many(self, table, conflict_names, names, rows, batch_size):
+        """
+        Upsert rows of values for names into table, like upsert(). Returns
+        the number of rows sent.
+
+        The default implementation upserts each row individually. Drivers
+        should override it to send rows in batches of batch_size.
+        """
+        count = 0
+        for row in rows:
+            self.upsert(table, conflict_names, dict(zip(names, row)))
+            count += 1
+        return count
+
     @abstractmethod
-    def select(self, tables, criteria, columns, distinct):
+    def select(self, tables, criteria, columns, distinct, group_by=(),
+               order_by=(), limit=None, offset=None, joins=()):
         """
         Return rows of columns from tables which match criteria.
+
+        Columns may be expressions, aggregated over each distinct value of
+        the expressions in group_by. Rows are sorted by order_by, and at
+        most limit of them are returned after skipping offset rows.
+
+        Joins lists (kind, table, condition) for tables joined explicitly,
+        starting with the table the rest are joined to.
         """
         return
 
+    def select_statement(self, tables, criteria, columns, distinct,
+                         group_by=(), order_by=(), limit=None, offset=None,
+                         joins=()):
+        """
+        Returns the statement and values which select() would execute.
+
+        This method is an optional extension. Without it, results of
+        selections can't be cached.
+        """
+        raise NotImplementedError
+
+    def count_rows(self, statement, values):
+        """
+        Returns the number of rows a select statement, as returned by
+        select_statement(), would return with values bound.
+
+        This method is an optional extension. Without it, grouped and
+        limited selections can't be counted.
+        """
+        raise NotImplementedError
+
+    def explain(self, statement, values, tables):
+        """
+        Returns the QueryPlan the database would follow to execute a select
+        statement with values, which reads from tables.
+
+        This method is an optional extension. It should be implemented if
+        possible, but its absence does not prevent normal operation.
+        """
+        raise NotImplementedError
+
+    def changed(self, *tables):
+        """
+        Record that the contents or schema of tables have changed, and
+        forget their cached rows.
+        """
+        for table in tables:
+            table.version += 1
+            table.clear_row_cache()
+
     @abstractmethod
     def update(self, table, criteria, values):
         """
@@ -177,6 +391,23 @@ class Driver(metaclass=ABCMeta):
         """
         return
 
+    def update_many(self, table, key_name, names, rows, batch_size):
+        """
+        Set values for names in the rows of table identified by the value of
+        the column key_name. Each row is a sequence of values for names
+        followed by the value of the key. Returns the number of rows
+        updated.
+
+        The default implementation updates each row individually. Drivers
+        should override it to send rows in batches of batch_size.
+        """
+        key = table.columns[key_name]
+        count = 0
+        for row in rows:
+            self.update(table, key == row[-1], dict(zip(names, row)))
+            count += 1
+        return count
+
     @abstractmethod
     def delete(self, tables, criteria):
         """
@@ -191,11 +422,42 @@ def operator(string):
     return operation
 
 
+class ConnectionState(threading.local):
+    """
+    Per-thread record of the connection a DbapiDriver has checked out, the
+    statement it last executed, and the tables changed by its open
+    transaction.
+    """
+    connection = None
+    depth = 0
+    transaction_depth = 0
+    last_statement = None
+    last_values = None
+
+    def __init__(self):
+        self.changed_tables = set()
+
+
 class DbapiDriver(Driver):
     """
     Driver subclass for writing DBAPI compatible drivers.
+
+    By default a single connection is opened and shared. Passing pool, a
+    dict of ConnectionPool options (minsize, maxsize, idle_timeout,
+    pre_ping, timeout), instead checks out a connection from a pool for
+    each transaction or Selection, so the driver may be used by several
+    threads at once.
+
+    Functions in before_execute are called with each statement and its
+    values before they are executed, and those in after_execute with an
+    Execution recording how long it took, once its results are fetched.
     """
+
+    # Maximum number of compiled statements remembered by statement_cache
+    statement_cache_size = 256
+
     def __init__(self, dbapi_module, *args, **kwargs):
+        pool = kwargs.pop('pool', None)
         # Fail early if these required attributes aren't present
         self.identifier_quote
         try:
@@ -205,34 +467,197 @@ class DbapiDriver(Driver):
 
         super(DbapiDriver, self).__init__()
         self.dbapi_module = dbapi_module
+        self.local = ConnectionState()
+
+        def connect():
+            return self.connect(*args, **kwargs)
         with self.catch_exception():
-            self.connection = self.connect(*args, **kwargs)
-        self.transaction_depth = 0
+            if pool is None:
+                self.pool = SingleConnection(connect)
+            else:
+                self.pool = ConnectionPool(connect, ping=self.ping,
+                                           reset=self.reset, **pool)
+        self.statement_cache = LRUCache(self.statement_cache_size)
+        self.before_execute = []
+        self.after_execute = []
+        self.encoders = LRUCache(self.statement_cache_size)
 
     def connect(self, *args, **kwargs):
         return self.dbapi_module.connect(*args, **kwargs)
 
-    def placeholders(self, values):
-        if self.dbapi_module.paramstyle == 'qmark':
-            return (values.keys(),
-                    (C("?") for key in values),
-                    list(values.values()))
-        elif self.dbapi_module.paramstyle == 'format':
-            return (values.keys(),
-                    (C("%s") for key in values),
-                    list(values.values()))
-        elif self.dbapi_module.paramstyle == 'numeric':
-            return (values.keys(),
-                    (C(":{}").format(C(i)) for i, key in enumerate(values)),
-                    list(values.values()))
-        elif self.dbapi_module.paramstyle == 'named':
-            return (values.keys(),
-                    (C(":{}").format(C(key)) for key in values),
-                    values)
-        elif self.dbapi_module.paramstyle == 'pyformat':
-            return (values.keys(),
-                    (C("%({})s").format(C(key)) for key in values),
-                    values)
+    @property
+    def pooled(self):
+        return isinstance(self.pool, ConnectionPool)
+
+    @property
+    def connection(self):
+        """
+        The connection reserved by the current thread.
+
+        Unpooled drivers always have their single connection available.
+        """
+        connection = self.local.connection
+        if connection is None:
+            if self.pooled:
+                raise RuntimeError("No connection is checked out by this "
+                                   "thread. Use DbapiDriver.connected()")
+            return self.pool.connection
+        return connection
+
+    @contextmanager
+    def connected(self):
+        local = self.local
+        if not local.depth:
+            with self.catch_exception():
+                local.connection = self.pool.checkout()
+        local.depth += 1
+        try:
+            yield local.connection
+        finally:
+            local.depth -= 1
+            if not local.depth:
+                connection, local.connection = local.connection, None
+                self.pool.checkin(connection)
+
+    @property
+    def transaction_depth(self):
+        return self.local.transaction_depth
+
+    @property
+    def last_statement(self):
+        """
+        The statement most recently executed by the current thread.
+        """
+        return self.local.last_statement
+
+    @last_statement.setter
+    def last_statement(self, statement):
+        self.local.last_statement = statement
+
+    @property
+    def last_values(self):
+        """
+        The values most recently bound to a statement by the current thread.
+        """
+        return self.local.last_values
+
+    @last_values.setter
+    def last_values(self, values):
+        self.local.last_values = values
+
+    def ping(self, connection):
+        """
+        Returns whether connection is still usable.
+        """
+        try:
+            connection.cursor().execute(self.construct_statement(
+                C("SELECT 1")))
+        except Exception:
+            return False
+        return True
+
+    def reset(self, connection):
+        """
+        Roll back any transaction left open on connection, before it is
+        returned to the pool for another thread to use.
+        """
+        if getattr(connection, 'in_transaction', True):
+            connection.rollback()
+
+    def close(self):
+        """
+        Close all connections which aren't in use.
+        """
+        self.pool.close()
+
+    def placeholder(self, index):
+        """
+        Return the placeholder for the index-th value bound to a statement.
+        """
+        paramstyle = self.dbapi_module.paramstyle
+        if paramstyle == 'qmark':
+            return C("?")
+        elif paramstyle == 'format':
+            return C("%s")
+        elif paramstyle == 'numeric':
+            return C(":{}").format(C(index + 1))
+        elif paramstyle == 'named':
+            return C(":p{}").format(C(index))
+        elif paramstyle == 'pyformat':
+            return C("%(p{})s").format(C(index))
+
+    def bind(self, values):
+        """
+        Arrange a sequence of values to match the placeholders of paramstyle.
+        """
+        if self.dbapi_module.paramstyle in ('named', 'pyformat'):
+            return {'p{}'.format(index): value
+                    for index, value in enumerate(values)}
+        return list(values)
+
+    def name_filter(self, column, names, values):
+        """
+        Returns words restricting column to one of names, binding them, or
+        nothing if names is None.
+        """
+        if names is None:
+            return ()
+        words = []
+        for name in names:
+            values.append(name)
+            words.append(self.placeholder(len(values) - 1))
+        return (C("AND"), column, C("IN ({})").format(C(", ").join(words)))
+
+    def group_reflected(self, names, column_rows, index_rows):
+        """
+        Returns reflect()'s result from rows of (table name, column) and of
+        (table name, index name, unique, column name), ordered by table and
+        by position within each index.
+
+        Indexes with any NULL column name are on expressions, which can't be
+        represented as Indexes, and are left out.
+        """
+        tables = OrderedDict()
+        for name, column in column_rows:
+            tables.setdefault(name, ([], OrderedDict()))[0].append(column)
+        expressions = set()
+        for name, index, unique, column in index_rows:
+            if column is None:
+                expressions.add((name, index))
+            if name in tables:
+                columns, unique = tables[name][1].setdefault(
+                    index, ([], bool(unique)))
+                columns.append(column)
+        for name, index in expressions:
+            if name in tables:
+                del tables[name][1][index]
+        if names is not None:
+            for name in names:
+                if name not in tables:
+                    raise NoSuchTableError(name)
+        return [(name, columns, [
+            (index, tuple(index_columns), unique)
+            for index, (index_columns, unique) in indexes.items()])
+            for name, (columns, indexes) in tables.items()]
+
+    def placeholders(self, values, offset=0):
+        """
+        Returns the names, placeholders and bound values for a mapping of
+        names to values, numbered from offset.
+        """
+        return (values.keys(),
+                [self.placeholder(index) for index in
+                 range(offset, offset + len(values))],
+                self.bind(values.values()))
+
+    def begin(self):
+        """
+        Start a transaction explicitly.
+
+        DBAPI connections begin transactions implicitly, so by default this
+        does nothing.
+        """
+        return
 
     def commit(self):
         self.connection.commit()
@@ -240,20 +665,99 @@ class DbapiDriver(Driver):
     def rollback(self):
         self.connection.rollback()
 
+    def savepoint_name(self, depth):
+        return self.identifier('dibi_savepoint_{}'.format(depth))
+
+    def savepoint(self, depth):
+        self.execute_ro(C("SAVEPOINT"), self.savepoint_name(depth))
+
+    def release_savepoint(self, depth):
+        self.execute_ro(C("RELEASE SAVEPOINT"), self.savepoint_name(depth))
+
+    def rollback_savepoint(self, depth):
+        self.execute_ro(C("ROLLBACK TO SAVEPOINT"),
+                        self.savepoint_name(depth))
+        self.release_savepoint(depth)
+
     @contextmanager
-    def transaction(self):
-        self.transaction_depth += 1
-        error = None
+    def transaction(self, savepoint=True):
+        """
+        Group statements executed within the block into one transaction.
+
+        Changes are committed when the outermost block exits, or rolled back
+        if it or the commit raises an exception. Nested blocks are
+        savepoints, which roll back only their own changes when they raise.
+        If savepoint is false, a nested block simply joins the enclosing
+        transaction.
+
+        Without the 'transactions' feature, for example on MySQL's MyISAM
+        engine, the database ignores rollbacks and keeps every change, so
+        an explicit transaction (one with savepoint true) warns with
+        NonTransactionalWarning when it begins.
+        """
+        if savepoint and 'transactions' not in self.features:
+            warnings.warn(
+                "{!r} does not support transactions; changes can't be "
+                "rolled back".format(self), NonTransactionalWarning,
+                stacklevel=3)
+        with self.connected():
+            local = self.local
+            depth = local.transaction_depth
+            if savepoint:
+                if depth:
+                    self.savepoint(depth)
+                else:
+                    self.begin()
+            local.transaction_depth += 1
+            try:
+                with self.catch_exception():
+                    yield self
+            except BaseException:
+                local.transaction_depth -= 1
+                if not depth:
+                    self.end_transaction(commit=False)
+                elif savepoint:
+                    self.rollback_savepoint(depth)
+                raise
+            else:
+                local.transaction_depth -= 1
+                if not depth:
+                    self.end_transaction(commit=True)
+                elif savepoint:
+                    self.release_savepoint(depth)
+
+    def end_transaction(self, commit):
+        """
+        Commit or roll back the current thread's outermost transaction.
+
+        Other threads may have read and cached the previous contents of the
+        tables it changed until now, so they are recorded as changed again
+        once it has ended.
+        """
+        local = self.local
         try:
-            with self.catch_exception():
-                yield self
-        finally:
-            self.transaction_depth -= 1
-            if not self.transaction_depth:
-                if error is None:
+            if not commit:
+                self.rollback()
+                return
+            try:
+                with self.catch_exception():
                     self.commit()
-                else:
+            except BaseException:
+                # Leave the connection usable, but report the commit's
+                # failure rather than any rollback's
+                try:
                     self.rollback()
+                except Exception:
+                    pass
+                raise
+        finally:
+            tables, local.changed_tables = local.changed_tables, set()
+            self.changed(*tables)
+
+    def changed(self, *tables):
+        super(DbapiDriver, self).changed(*tables)
+        if self.local.transaction_depth:
+            self.local.changed_tables.update(tables)
 
     @classmethod
     def construct_statement(cls, *words):
@@ -287,6 +791,86 @@ class DbapiDriver(Driver):
         return str(C('{};').join_format(
             C(' '), (word for word in words if word)))
 
+    def compile(self, shape, build):
+        """
+        Return the SQL text for a statement of the given shape.
+
+        The shape is a hashable description of the statement's structure.
+        Only when it hasn't been seen recently is build called to produce
+        the words passed to construct_statement.
+
+        >>> from dibi.driver.sqlite import SQLiteDriver
+
+        >>> driver = SQLiteDriver()
+
+        >>> build = lambda: (C("DELETE FROM"), C("a"))
+
+        >>> driver.compile(('DELETE', 'a'), build)
+        'DELETE FROM a;'
+
+        >>> driver.compile(('DELETE', 'a'), None)
+        'DELETE FROM a;'
+
+        >>> driver.statement_cache.hits, driver.statement_cache.misses
+        (1, 1)
+        """
+        try:
+            return self.statement_cache[shape]
+        except KeyError:
+            statement = self.construct_statement(*build())
+            self.statement_cache[shape] = statement
+            return statement
+
+    # Operators comparing their first argument with the others
+    comparisons = frozenset([
+        'EQUAL', 'NOTEQUAL', 'GREATERTHAN', 'GREATEREQUAL', 'LESSTHAN',
+        'LESSEQUAL', 'IN', 'NOTIN', 'BETWEEN'])
+
+    def comparison_encoder(self, value):
+        """
+        Returns the function encoding literals compared with a column by
+        the filter value, or None if it compares no column.
+
+        Literals are encoded like the column's values, so that, for
+        example, a datetime matches the text a DateTime column stores.
+        Literals the column's datatype can't represent, such as 2.5
+        compared with an Integer column, are compared as they are.
+        """
+        if (value.operator not in self.comparisons or
+                not isinstance(value.arguments[0], Column)):
+            return None
+        serialize = value.arguments[0].datatype.serialize
+        if serialize is identity:
+            return None
+
+        def encode(literal):
+            try:
+                return serialize(literal)
+            except (TypeError, ValueError):
+                return literal
+        return encode
+
+    def shape(self, value, values, encode=None):
+        """
+        Return a hashable description of the structure of an expression.
+
+        Literal values are appended to values in the order expression()
+        binds them, and are represented in the shape only by a marker.
+        NULL is written into statements directly, so it keeps its own.
+        """
+        if isinstance(value, Column):
+            return (value.table.name, value.name)
+        elif isinstance(value, Filter):
+            encode = self.comparison_encoder(value)
+            return (value.operator,) + tuple(
+                self.shape(argument, values, encode)
+                for argument in value.arguments)
+        elif value is None:
+            return None
+        else:
+            values.append(value if encode is None else encode(value))
+            return '?'
+
     def execute(self, *words, **kwargs):
         """
         Execute a SQL statement.
@@ -294,25 +878,78 @@ class DbapiDriver(Driver):
         If errors are not encountered, changes will be committed. If they are
         the action will be rolled back.
         """
-        with self.transaction():
+        with self.transaction(savepoint=False):
             return self.execute_ro(*words, **kwargs)
 
+    def execute_many(self, *words, **kwargs):
+        """
+        Execute a SQL statement once for each set of values.
+
+        The statement is built once. Values are sent to the database in
+        batches of batch_size, each of which is committed in its own
+        transaction. Returns the number of rows affected.
+        """
+        values = kwargs.pop('values', ())
+        batch_size = kwargs.pop('batch_size', 1000)
+        statement = kwargs.pop('statement', None)
+        if kwargs:
+            raise TypeError("execute_many() got an unexpected keyword "
+                            "argument '{}'".format(kwargs.popitem()[0]))
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        statement = self.last_statement = (
+            self.construct_statement(*words) if statement is None
+            else statement)
+        values = iter(values)
+        count = 0
+        while True:
+            batch = list(islice(values, batch_size))
+            if not batch:
+                return count
+            self.last_values = batch
+            for hook in self.before_execute:
+                hook(statement, batch)
+            with self.transaction(savepoint=False):
+                cursor = self.connection.cursor()
+                start = time.perf_counter()
+                cursor.executemany(statement, batch)
+                elapsed = time.perf_counter() - start
+            rowcount = len(batch) if cursor.rowcount < 0 else cursor.rowcount
+            count += rowcount
+            if self.after_execute:
+                execution = Execution(statement, batch, elapsed,
+                                      rowcount=rowcount)
+                for hook in self.after_execute:
+                    hook(execution)
+
     def execute_ro(self, *words, **kwargs):
         """
         Execute a SQL statement without initiating a transaction.
+
+        Instead of words, a statement previously built by compile() may be
+        passed as the statement keyword argument.
         """
         values = kwargs.pop('values', ())
+        statement = kwargs.pop('statement', None)
         if kwargs:
             raise TypeError("execute_ro() got an unexpected keyword argument "
                             "'{}'".format(kwargs.popitem()[0]))
-        self.last_statement = self.construct_statement(*words)
+        statement = self.last_statement = (
+            self.construct_statement(*words) if statement is None
+            else statement)
         self.last_values = values
+        for hook in self.before_execute:
+            hook(statement, values)
         cursor = self.connection.cursor()
-        try:
-            cursor.execute(self.last_statement, self.last_values)
-        except Exception:
-            raise
-        return cursor
+        if not self.after_execute:
+            cursor.execute(statement, values)
+            return cursor
+        start = time.perf_counter()
+        cursor.execute(statement, values)
+        elapsed = time.perf_counter() - start
+        return InstrumentedCursor(
+            cursor, Execution(statement, values, elapsed),
+            list(self.after_execute))
 
     @abstractmethod
     def map_type(self, database_type, database_size):
@@ -325,23 +962,63 @@ class DbapiDriver(Driver):
     # Syntax cleansers
 
     def literal(self, value):
+        """
+        Render a value directly as SQL.
+
+        Values in expressions are bound as parameters instead, so this is
+        only needed where placeholders aren't permitted.
+
+        >>> from dibi.driver.sqlite import SQLiteDriver
+
+        >>> literal = SQLiteDriver().literal
+
+        >>> print(literal("it's"), literal(True), literal(1.5))
+        'it''s' 1 1.5
+
+        >>> print(literal(b'dibi'), literal(datetime.date(2000, 1, 2)))
+        X'64696269' '2000-01-02'
+
+        >>> literal(float('nan'))
+        Traceback (most recent call last):
+         ...
+        TypeError: Can't convert nan to literal
+        """
         if value is None:
             return C('NULL')
         elif isinstance(value, str):
             return C("'{}'").format(C(value.replace("'", "''")))
+        elif isinstance(value, bool):
+            return C(int(value))
         elif isinstance(value, int):
             return C(value)
+        elif isinstance(value, float) and math.isfinite(value):
+            return C(repr(value))
+        elif isinstance(value, (bytes, bytearray)):
+            return C("X'{}'").format(C(bytes(value).hex()))
+        elif isinstance(value, (datetime.date, datetime.time)):
+            return self.literal(value.isoformat())
         raise TypeError("Can't convert {!r} to literal".format(value))
 
-    def expression(self, value):
+    def expression(self, value, values, encode=None):
+        """
+        Render an expression as SQL.
+
+        Literal values are replaced by placeholders and appended to values,
+        so that expressions of the same shape produce the same text.
+        """
         if isinstance(value, Column):
             return C("{}.{}").format(self.identifier(value.table.name),
                                      self.identifier(value.name))
         elif isinstance(value, Filter):
             operator = getattr(self.operators, value.operator)
-            return operator(*(self.expression(arg) for arg in value.arguments))
-        else:
+            encode = self.comparison_encoder(value)
+            return operator(*(self.expression(arg, values, encode)
+                              for arg in value.arguments))
+        elif value is None:
             return self.literal(value)
+        else:
+            values.append(value if encode is None else encode(value))
+            return self.placeholder(len(values) - 1)
 
     def identifier(self, value):
         name = C(value).replace(self.identifier_quote,
@@ -360,75 +1037,347 @@ class DbapiDriver(Driver):
     # Schema methods
 
     def create_table(self, table, columns, force_create):
+        try:
+            return self.execute(
+                C("CREATE TABLE"),
+                C("IF NOT EXISTS") if force_create else None,
+                self.identifier(table.name),
+                C("({})").join_format(C(", "), (
+                    self.column_definition(column) for column in columns)),
+            )
+        finally:
+            self.changed(table)
+
+    def drop_table(self, table, ignore_absence):
+        try:
+            return self.execute(
+                C("DROP TABLE"),
+                C("IF EXISTS") if ignore_absence else None,
+                self.identifier(table.name)
+            )
+        finally:
+            self.changed(table)
+
+    def create_index(self, table, index, force_create):
         return self.execute(
-            C("CREATE TABLE"),
+            C("CREATE"),
+            C("UNIQUE") if index.unique else None,
+            C("INDEX"),
             C("IF NOT EXISTS") if force_create else None,
+            self.identifier(index.name),
+            C("ON"),
             self.identifier(table.name),
             C("({})").join_format(C(", "), (
-                self.column_definition(column) for column in columns)),
+                self.identifier(column.name) for column in index.columns)),
         )
 
-    def drop_table(self, table, ignore_absence):
+    def drop_index(self, table, index, ignore_absence):
         return self.execute(
-            C("DROP TABLE"),
+            C("DROP INDEX"),
             C("IF EXISTS") if ignore_absence else None,
-            self.identifier(table.name)
+            self.identifier(index.name),
         )
 
     # Row methods
 
-    def insert(self, table, values):
-        names, placeholders, values = self.placeholders(values)
-        cursor = self.execute(
+    def insert_words(self, table, names):
+        _, placeholders, _ = self.placeholders(dict.fromkeys(names))
+        return (
             C("INSERT INTO"),
             self.identifier(table.name),
             C("({})").join_format(
                 C(", "), (self.identifier(key) for key in names)),
             C("VALUES"),
             C("({})").join_format(C(", "), placeholders),
-            values=values
         )
+
+    def insert_statement(self, table, names):
+        names = tuple(names)
+        return self.compile(('INSERT', table.name, names),
+                            lambda: self.insert_words(table, names))
+
+    def on_conflict(self, names, conflict_names):
+        """
+        Returns the words following an INSERT of names which update the
+        existing row instead if it conflicts on conflict_names.
+
+        Drivers which support upserts must override this.
+        """
+        raise NotImplementedError
+
+    def upsert_statement(self, table, names, conflict_names):
+        names = tuple(names)
+        conflict_names = tuple(conflict_names)
+        return self.compile(
+            ('UPSERT', table.name, names, conflict_names),
+            lambda: self.insert_words(table, names) + self.on_conflict(
+                names, conflict_names))
+
+    def table_encoder(self, table, names):
+        """
+        Returns a function serializing values for the named columns of
+        table, or None if none of them need serializing.
+        """
+        key = (table.name, names)
+        try:
+            return self.encoders[key]
+        except KeyError:
+            encode = self.encoders[key] = self.encoder(
+                table.columns[name].datatype if name in table.columns
+                else DataType for name in names)
+            return encode
+
+    def insert(self, table, values):
+        names = tuple(values)
+        values = tuple(values.values())
+        encode = self.table_encoder(table, names)
+        if encode is not None:
+            values = encode(values)
+        try:
+            cursor = self.execute(
+                statement=self.insert_statement(table, names),
+                values=self.bind(values))
+        finally:
+            self.changed(table)
         return cursor.lastrowid
 
-    def select(self, tables, criteria, columns, distinct):
-        return self.execute_ro(
-            C("SELECT"),
-            C("DISTINCT") if distinct else None,
-            C(", ").join(C("{}.{}").format(
-                self.identifier(column.table.name),
-                self.identifier(column.name)
-            ) for column in columns),
-            C("FROM"),
-            C(", ").join(self.identifier(table.name) for table in tables),
-            C("WHERE") if criteria else None,
-            self.expression(criteria) if criteria else None,
-        )
+    def insert_many(self, table, names, rows, batch_size):
+        names = tuple(names)
+        encode = self.table_encoder(table, names)
+        if encode is not None:
+            rows = map(encode, rows)
+        if self.dbapi_module.paramstyle in ('named', 'pyformat'):
+            rows = (self.bind(row) for row in rows)
+        try:
+            return self.execute_many(
+                statement=self.insert_statement(table, names),
+                values=rows, batch_size=batch_size)
+        finally:
+            self.changed(table)
+
+    def upsert(self, table, conflict_names, values):
+        names = tuple(values)
+        values = tuple(values.values())
+        encode = self.table_encoder(table, names)
+        if encode is not None:
+            values = encode(values)
+        statement = self.upsert_statement(table, names, conflict_names)
+        try:
+            self.execute(statement=statement, values=self.bind(values))
+        finally:
+            self.changed(table)
+
+    def upsert_many(self, table, conflict_names, names, rows, batch_size):
+        names = tuple(names)
+        encode = self.table_encoder(table, names)
+        if encode is not None:
+            rows = map(encode, rows)
+        if self.dbapi_module.paramstyle in ('named', 'pyformat'):
+            rows = (self.bind(row) for row in rows)
+        statement = self.upsert_statement(table, names, conflict_names)
+        # Rows are counted as they are sent, since databases report those
+        # affected differently; MySQL counts an updated row twice, and an
+        # unchanged one not at all
+        sent = 0
+
+        def counted(rows):
+            nonlocal sent
+            for row in rows:
+                sent += 1
+                yield row
+        try:
+            self.execute_many(statement=statement, values=counted(rows),
+                              batch_size=batch_size)
+        finally:
+            self.changed(table)
+        return sent
+
+    def where(self, criteria, values):
+        """
+        Returns the words of a WHERE clause matching criteria, if any.
+        """
+        if criteria is None:
+            return ()
+        return (C("WHERE"), self.expression(criteria, values))
+
+    def limit(self, limit, offset, values):
+        """
+        Returns the words of LIMIT and OFFSET clauses, binding their values.
+        """
+        words = ()
+        if limit is not None or offset is not None:
+            if limit is None:
+                words += (C("LIMIT"), self.no_limit)
+            else:
+                values.append(limit)
+                words += (C("LIMIT"), self.placeholder(len(values) - 1))
+        if offset is not None:
+            values.append(offset)
+            words += (C("OFFSET"), self.placeholder(len(values) - 1))
+        return words
+
+    # Stands in for a LIMIT when only an OFFSET is wanted
+    no_limit = C("-1")
+
+    def sources(self, tables, joins, values):
+        """
+        Returns the list of tables for a FROM clause.
+
+        Tables which aren't explicitly joined are listed first, followed by
+        the joined tables with their JOIN clauses.
+        """
+        joined = {table for kind, table, condition in joins}
+        words = [self.identifier(table.name)
+                 for table in tables if table not in joined]
+        if joins:
+            words.append(C(" ").join_words(
+                self.identifier(joins[0][1].name),
+                *(C(" ").join_words(
+                    self.join_kinds[kind],
+                    self.identifier(table.name),
+                    C("ON") if condition is not None else None,
+                    self.expression(condition, values)
+                    if condition is not None else None,
+                ) for kind, table, condition in joins[1:])))
+        return C(", ").join(words)
+
+    join_kinds = dict(
+        inner=C("INNER JOIN"),
+        left=C("LEFT JOIN"),
+        cross=C("CROSS JOIN"),
+    )
+
+    def select_statement(self, tables, criteria, columns, distinct,
+                         group_by=(), order_by=(), limit=None, offset=None,
+                         joins=()):
+        values = []
+        joined = {table for kind, table, condition in joins}
+        shape = ('SELECT', distinct,
+                 tuple(self.shape(column, values) for column in columns),
+                 tuple(table.name for table in tables if table not in joined),
+                 tuple((kind, table.name, self.shape(condition, values))
+                       for kind, table, condition in joins),
+                 self.shape(criteria, values),
+                 tuple(self.shape(group, values) for group in group_by),
+                 tuple(self.shape(order, values) for order in order_by),
+                 limit is None, offset is None)
+        self.limit(limit, offset, values)
+
+        def build():
+            bound = []
+            return (
+                C("SELECT"),
+                C("DISTINCT") if distinct else None,
+                C(", ").join(
+                    self.expression(column, bound) for column in columns),
+                C("FROM"),
+                self.sources(tables, joins, bound),
+            ) + self.where(criteria, bound) + ((
+                C("GROUP BY"),
+                C(", ").join(
+                    self.expression(group, bound) for group in group_by),
+            ) if group_by else ()) + ((
+                C("ORDER BY"),
+                C(", ").join(
+                    self.expression(order, bound) for order in order_by),
+            ) if order_by else ()) + self.limit(limit, offset, bound)
+        return self.compile(shape, build), self.bind(values)
+
+    def select(self, tables, criteria, columns, distinct, group_by=(),
+               order_by=(), limit=None, offset=None, joins=()):
+        statement, values = self.select_statement(
+            tables, criteria, columns, distinct, group_by=group_by,
+            order_by=order_by, limit=limit, offset=offset, joins=joins)
+        return self.execute_ro(statement=statement, values=values)
+
+    def count_rows(self, statement, values):
+        with self.connected():
+            cursor = self.execute_ro(
+                C("SELECT count(*) FROM"),
+                C("({}) AS {}").format(
+                    C(statement.rstrip(';')), self.identifier('selection')),
+                values=values)
+            try:
+                (count,), = cursor.fetchall()
+            finally:
+                cursor.close()
+        return count
 
     def update(self, table, criteria, values):
-        names, placeholders, values = self.placeholders(values)
-        pairs = zip(names, placeholders)
-        self.execute(
-            C("UPDATE"),
-            self.identifier(table.name),
-            C("SET"),
-            C(", ").join(
+        names, placeholders, _ = self.placeholders(values)
+        names = tuple(names)
+        values = list(values.values())
+        encode = self.table_encoder(table, names)
+        if encode is not None:
+            values = list(encode(values))
+        shape = ('UPDATE', table.name, tuple(names),
+                 self.shape(criteria, values))
+
+        def build():
+            bound = [None] * len(names)
+            return (
+                C("UPDATE"),
+                self.identifier(table.name),
+                C("SET"),
+                C(", ").join(
+                    C("{}={}").format(
+                        self.identifier(name),
+                        placeholder,
+                    ) for name, placeholder in zip(names, placeholders)
+                ),
+            ) + self.where(criteria, bound)
+        try:
+            self.execute(statement=self.compile(shape, build),
+                         values=self.bind(values))
+        finally:
+            self.changed(table)
+
+    def update_many(self, table, key_name, names, rows, batch_size):
+        names = tuple(names)
+        encode = self.table_encoder(table, names + (key_name,))
+        if encode is not None:
+            rows = map(encode, rows)
+        if self.dbapi_module.paramstyle in ('named', 'pyformat'):
+            rows = (self.bind(row) for row in rows)
+
+        def build():
+            _, placeholders, _ = self.placeholders(
+                dict.fromkeys(names + (key_name,)))
+            return (
+                C("UPDATE"),
+                self.identifier(table.name),
+                C("SET"),
+                C(", ").join(
+                    C("{}={}").format(self.identifier(name), placeholder)
+                    for name, placeholder in zip(names, placeholders)),
+                C("WHERE"),
                 C("{}={}").format(
-                    self.identifier(name),
-                    placeholder,
-                ) for name, placeholder in pairs
-            ),
-            C("WHERE") if criteria else None,
-            self.expression(criteria) if criteria else None,
-            values=values,
-        )
+                    self.identifier(key_name), placeholders[-1]),
+            )
+        statement = self.compile(
+            ('UPDATE_MANY', table.name, names, key_name), build)
+        try:
+            return self.execute_many(
+                statement=statement, values=rows, batch_size=batch_size)
+        finally:
+            self.changed(table)
 
     def delete(self, tables, criteria):
-        self.execute(
-            C("DELETE FROM"),
-            C(", ").join(self.identifier(table.name) for table in tables),
-            C("WHERE") if criteria else None,
-            self.expression(criteria) if criteria else None,
-        )
+        values = []
+        shape = ('DELETE', tuple(table.name for table in tables),
+                 self.shape(criteria, values))
+
+        def build():
+            return (
+                C("DELETE FROM"),
+                C(", ").join(
+                    self.identifier(table.name) for table in tables),
+            ) + self.where(criteria, [])
+        try:
+            self.execute(statement=self.compile(shape, build),
+                         values=self.bind(values))
+        finally:
+            self.changed(*tables)
 
     class operators:
 
@@ -464,6 +1413,35 @@ class DbapiDriver(Driver):
             return (C("({} IS NOT {})".format(a, b)) if 'NULL' in (a, b)
                     else C("({}!={})".format(a, b)))
 
+        def IN(a, *values):
+            """
+
+            >>> print(DbapiDriver.operators.IN(1, 2, 3))
+            (1 IN (2, 3))
+
+            >>> print(DbapiDriver.operators.IN(1))
+            (1=0)
+            """
+            if not values:
+                return C("(1=0)")
+            return C("({} IN ({}))".format(
+                a, ", ".join(map(str, values))))
+
+        def NOTIN(a, *values):
+            """
+
+            >>> print(DbapiDriver.operators.NOTIN(1, 2, 3))
+            (1 NOT IN (2, 3))
+
+            >>> print(DbapiDriver.operators.NOTIN(1))
+            (1=1)
+            """
+            if not values:
+                return C("(1=1)")
+            return C("({} NOT IN ({}))".format(
+                a, ", ".join(map(str, values))))
+
+        BETWEEN = operator("({} BETWEEN {} AND {})")
         GREATERTHAN = operator("({} > {})")
         GREATEREQUAL = operator("({} >= {})")
         LESSTHAN = operator("({} < {})")
@@ -482,21 +1460,128 @@ class DbapiDriver(Driver):
 
         # Aggregate functions
 
+        COUNTALL = operator("count(*)")
+        COUNTDISTINCT = operator("count(DISTINCT {})")
         SUM = operator("sum({})")
         AVERAGE = operator("avg({})")
         MAXIMUM = operator("max({})")
         MINIMUM = operator("min({})")
         COUNT = operator("count({})")
 
+        # Sort order
+
+        ASCENDING = operator("{} ASC")
+        DESCENDING = operator("{} DESC")
+
+
+def find_entry_points(group):
+    """
+    Returns the entry points installed in group.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return ()
+    found = entry_points()
+    if hasattr(found, 'select'):
+        return found.select(group=group)
+    # Before Python 3.10, entry points are grouped in a dict
+    return found.get(group, ())
+
+
+class DriverRegistry(Mapping):
+    """
+    Driver classes by name, imported only when first requested.
+
+    Drivers are added by name with the module defining them, which must
+    register() them when imported. Drivers from other packages are found
+    through the entry points of group, each of which is named for its
+    driver and refers to the driver class.
+
+    >>> registry = DriverRegistry(group=None)
+
+    >>> registry.add('sqlite', 'dibi.driver.sqlite')
+
+    >>> 'sqlite' in registry, 'other' in registry
+    (True, False)
+
+    >>> registry['other']
+    Traceback (most recent call last):
+     ...
+    KeyError: 'other'
+    """
+
+    def __init__(self, group='dibi.drivers'):
+        self.group = group
+        self.modules = {}
+        self.classes = {}
+        # Entry points of group by name, once they've been looked for
+        self.entry_points = None
+
+    def add(self, name, module):
+        """
+        Record that the driver called name is registered by module.
+        """
+        self.modules[name] = module
+
+    def register(self, name, class_):
+        self.classes[name] = class_
+
+    def discover(self):
+        """
+        Returns the entry points of installed drivers by name.
+        """
+        if self.entry_points is None:
+            self.entry_points = {}
+            if self.group is not None:
+                for entry_point in find_entry_points(self.group):
+                    self.entry_points.setdefault(entry_point.name,
+                                                 entry_point)
+        return self.entry_points
+
+    def names(self):
+        """
+        Returns the names of all drivers, without importing them.
+        """
+        return set(self.classes) | set(self.modules) | set(self.discover())
+
+    def __getitem__(self, name):
+        """
+        Returns the driver class called name, importing it if necessary.
+        Raises KeyError if there is no such driver, or ImportError if its
+        module or one of its dependencies can't be imported.
+        """
+        try:
+            return self.classes[name]
+        except KeyError:
+            pass
+        if name in self.modules:
+            import_module(self.modules[name])
+        else:
+            entry_point = self.discover().get(name)
+            if entry_point is None:
+                raise KeyError(name)
+            self.classes.setdefault(name, entry_point.load())
+        return self.classes[name]
+
+    def __contains__(self, name):
+        return name in self.names()
+
+    def __iter__(self):
+        return iter(sorted(self.names()))
+
+    def __len__(self):
+        return len(self.names())
+
 
-registry = dict()
+registry = DriverRegistry()
 
 
 def register(name_or_class, class_=None):
     if class_ is not None:
-        registry[name_or_class] = class_
+        registry.register(name_or_class, class_)
     else:
         def decorated(class_):
-            registry[name_or_class] = class_
+            registry.register(name_or_class, class_)
             return class_
         return decorated
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""
+Measurement of the statements a DbapiDriver executes.
+
+Functions in a driver's after_execute list are called with an Execution
+describing each statement once its results have been fetched.
+
+>>> import dibi
+
+>>> db = dibi.DB.connect('sqlite')
+
+>>> statistics = StatementStatistics()
+
+>>> db.driver.after_execute.append(statistics)
+
+>>> table = db.add_table('numbers')
+
+>>> _ = table.add_column('n', dibi.Integer)
+
+>>> table.save()
+
+>>> for n in range(3):
+...     _ = table.insert(n=n)
+
+>>> len((table.n > 0).select_all())
+2
+
+>>> for entry in sorted(statistics.report()):
+...     print(entry.calls, entry.rows, entry.fingerprint[:48])
+1 0 CREATE TABLE "numbers" ("n" INT, "__id__" INTEGE
+3 3 INSERT INTO "numbers" ("n") VALUES (?);
+1 2 SELECT "numbers"."n" FROM "numbers" WHERE ("numb
+"""
+
+from collections import deque, namedtuple
+import logging
+import math
+import re
+import threading
+import time
+
+
+class Execution(object):
+    """
+    Record of one execution of a statement.
+
+    Elapsed is the time taken to execute it, and fetch_time the time spent
+    fetching its results. Rowcount is the number of rows fetched, or for
+    statements which return no rows, the number the database reports were
+    affected.
+    """
+
+    __slots__ = ('statement', 'values', 'elapsed', 'fetch_time', 'rowcount')
+
+    def __init__(self, statement, values, elapsed, fetch_time=0.0,
+                 rowcount=0):
+        self.statement = statement
+        self.values = values
+        self.elapsed = elapsed
+        self.fetch_time = fetch_time
+        self.rowcount = rowcount
+
+    @property
+    def total_time(self):
+        return self.elapsed + self.fetch_time
+
+    def __repr__(self):
+        return "<Execution({!r}, {:.6f}s, {} rows)>".format(
+            self.statement, self.total_time, self.rowcount)
+
+
+class InstrumentedCursor(object):
+    """
+    Cursor wrapper which measures the time spent fetching rows, and passes
+    the completed Execution to hooks when the rows are exhausted or the
+    cursor is closed.
+    """
+
+    def __init__(self, cursor, execution, hooks):
+        self.cursor = cursor
+        self.execution = execution
+        self.hooks = hooks
+        self.finished = False
+        if cursor.description is None:
+            execution.rowcount = cursor.rowcount
+            self.finish()
+        else:
+            execution.rowcount = 0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            for hook in self.hooks:
+                hook(self.execution)
+
+    def fetched(self, rows, start, exhausted):
+        self.execution.fetch_time += time.perf_counter() - start
+        self.execution.rowcount += len(rows)
+        if exhausted:
+            self.finish()
+        return rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        if row is None:
+            self.fetched((), start, True)
+        else:
+            self.fetched((row,), start, False)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = (self.cursor.fetchmany() if size is None
+                else self.cursor.fetchmany(size))
+        return self.fetched(rows, start, not rows)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        return self.fetched(self.cursor.fetchall(), start, True)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self.cursor.close()
+        self.finish()
+
+
+def fingerprint(statement):
+    """
+    Normalize a statement so that executions differing only in their
+    literal values are counted together.
+
+    >>> print(fingerprint(
+    ...     "SELECT * FROM \\"t 1\\" WHERE a = 'x'  AND b IN (1, 2.5);"))
+    SELECT * FROM "t 1" WHERE a = ? AND b IN (...);
+    """
+    statement = FINGERPRINT_TOKENS.sub(
+        lambda match: match.group() if match.group('identifier') else '?',
+        statement)
+    statement = FINGERPRINT_LISTS.sub('(...)', statement)
+    return ' '.join(statement.split())
+
+
+# Quoted identifiers, which are kept, and literals, which are replaced
+FINGERPRINT_TOKENS = re.compile(
+    r"(?P<identifier>\"(?:[^\"]|\"\")*\"|`(?:[^`]|``)*`)"
+    r"|'(?:[^']|'')*'|(?<!\w)-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+FINGERPRINT_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+StatementReport = namedtuple('StatementReport', [
+    'fingerprint', 'calls', 'total_time', 'average_time', 'p99_time',
+    'rows'])
+
+
+class StatementTotals(object):
+    def __init__(self, samples):
+        self.calls = 0
+        self.total_time = 0.0
+        self.rows = 0
+        # Most recent execution times, from which percentiles are estimated
+        self.times = deque(maxlen=samples)
+
+
+class StatementStatistics(object):
+    """
+    Totals of executions grouped by statement fingerprint, like
+    pg_stat_statements. Add it to a driver's after_execute hooks.
+
+    Percentiles are estimated from the latest samples executions of each
+    statement.
+    """
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, execution):
+        key = fingerprint(execution.statement)
+        with self.lock:
+            totals = self.totals.get(key)
+            if totals is None:
+                totals = self.totals[key] = StatementTotals(self.samples)
+            totals.calls += 1
+            totals.total_time += execution.total_time
+            # DBAPI cursors report -1 when the number of rows is unknown
+            if execution.rowcount >= 0:
+                totals.rows += execution.rowcount
+            totals.times.append(execution.total_time)
+
+    def report(self):
+        """
+        Returns a StatementReport for each fingerprint, those taking the
+        most time in total first.
+        """
+        with self.lock:
+            reports = [
+                StatementReport(
+                    key, totals.calls, totals.total_time,
+                    totals.total_time / totals.calls,
+                    percentile(totals.times, 0.99), totals.rows)
+                for key, totals in self.totals.items()]
+        return sorted(reports, key=lambda report: (
+            -report.total_time, -report.calls))
+
+    def clear(self):
+        with self.lock:
+            self.totals.clear()
+
+
+def percentile(values, fraction):
+    """
+    >>> percentile(range(1, 101), 0.99)
+    99
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class SlowQueryLog(object):
+    """
+    Logs executions which take at least threshold seconds, and keeps the
+    latest size of them. Add it to a driver's after_execute hooks.
+    """
+
+    def __init__(self, threshold, size=100,
+                 logger=logging.getLogger('dibi.slow_query')):
+        self.threshold = threshold
+        self.logger = logger
+        self.entries = deque(maxlen=size)
+
+    def __call__(self, execution):
+        if execution.total_time >= self.threshold:
+            self.entries.append(execution)
+            self.logger.warning(
+                "Slow statement (%.3fs, %d rows): %s %r",
+                execution.total_time, execution.rowcount,
+                execution.statement, execution.values)
@@ -1,7 +1,7 @@
 
 
 from .common import DbapiDriver, C, register, operator
-from ..common import Column
+from ..common import Column, PlanStep, QueryPlan
 from ..error import (NoSuchTableError, ConnectionError, AuthenticationError,
                      NoSuchDatabaseError, TableAlreadyExists)
 from ..datatype import Text, Integer, Float, Blob, DateTime
@@ -16,6 +16,11 @@ class MysqlDriver(DbapiDriver):
     mysql requires only one parameter: database, which is the name of the
     database to use.
 
+    Tables are created with the storage engine named by engine. Only InnoDB
+    and BDB tables support transactions; with other engines, including the
+    default MyISAM, rolled back changes are kept, and transactions warn
+    with NonTransactionalWarning.
+
     >>> import dibi
 
     """
@@ -27,15 +32,20 @@ class MysqlDriver(DbapiDriver):
 
     identifier_quote = C('`')
 
+    no_limit = C("18446744073709551615")
+
+    # Placeholders in a prepared statement are counted in 16 bits
+    parameter_limit = 65535
+
     def __init__(self, database, user='root', password=None, host='localhost',
-                 engine='MyISAM', port=3306, debug=False):
+                 engine='MyISAM', port=3306, debug=False, pool=None):
         self.database = database
         self.user = user
         self.password = password
         with self.catch_exception():
             super(MysqlDriver, self).__init__(
                 mysql, host=host, port=port, user=user,
-                password=password or '', database=database)
+                password=password or '', database=database, pool=pool)
         self.engine = engine
         self.debug = debug
 
@@ -80,7 +90,7 @@ class MysqlDriver(DbapiDriver):
         name, _, size = t.partition('(')
         if size:
             size = size[:-1]
-        return dict(
+        datatype = dict(
             int=Integer,
             tinyint=Integer,
             text=Text,
@@ -89,31 +99,136 @@ class MysqlDriver(DbapiDriver):
             double=Float,
             real=Float,
             blob=Blob,
-        )[name]
+        ).get(name)
+        if datatype is None:
+            return self.unknown_type(t)
+        return datatype
 
     def list_tables(self):
-        return (table for (table,) in self.execute_ro(C("SHOW TABLES")))
+        with self.connected():
+            rows = self.execute_ro(C("SHOW TABLES")).fetchall()
+        return (table for (table,) in rows)
 
     def list_columns(self, table):
-        for name, type, null, key, default, extra in self.execute_ro(
-                C("SHOW COLUMNS FROM"), self.identifier(table)):
+        with self.connected():
+            rows = self.execute_ro(
+                C("SHOW COLUMNS FROM"), self.identifier(table)).fetchall()
+        for name, type, null, key, default, extra in rows:
             datatype = self.unmap_type(type)
-            if datatype is None:
-                raise Exception('Unknown column type %s' % v_type)
             yield Column(
                 None, None, name, datatype, primarykey=(key == 'PRI'),
                 autoincrement=(extra == 'auto_increment'),
             )
 
+    def on_conflict(self, names, conflict_names):
+        # MySQL updates the row conflicting on any unique key, whichever
+        # columns were named
+        updated = [name for name in names if name not in conflict_names]
+        return (
+            C("ON DUPLICATE KEY UPDATE"),
+            C(", ").join(C("{0}=VALUES({0})").format(self.identifier(name))
+                         for name in updated or names[:1]),
+        )
+
+    def reflect(self, names=None):
+        if names is not None:
+            names = list(names)
+        values = []
+        only = self.name_filter(C("TABLE_NAME"), names, values)
+        with self.connected():
+            columns = self.execute_ro(
+                C("SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, COLUMN_KEY,"
+                  " EXTRA FROM information_schema.COLUMNS"
+                  " WHERE TABLE_SCHEMA = DATABASE()"), *only + (
+                    C("ORDER BY TABLE_NAME, ORDINAL_POSITION"),),
+                values=self.bind(values)).fetchall()
+            indexes = self.execute_ro(
+                C("SELECT TABLE_NAME, INDEX_NAME, NOT NON_UNIQUE, COLUMN_NAME"
+                  " FROM information_schema.STATISTICS"
+                  " WHERE TABLE_SCHEMA = DATABASE()"
+                  " AND INDEX_NAME <> 'PRIMARY'"), *only + (
+                    C("ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"),),
+                values=self.bind(values)).fetchall()
+        return self.group_reflected(names, (
+            (table, Column(None, None, name, self.unmap_type(type),
+                           primarykey=(key == 'PRI'),
+                           autoincrement=(extra == 'auto_increment')))
+            for table, name, type, key, extra in columns), indexes)
+
+    def explain(self, statement, values, tables):
+        tables = {table.name: table for table in tables}
+        with self.connected():
+            cursor = self.execute_ro(statement='EXPLAIN ' + statement,
+                                     values=values)
+            names = [description[0] for description in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        return QueryPlan(statement, [
+            PlanStep(
+                tables.get(row['table']),
+                "{} {} key={} rows={}".format(
+                    row['type'], row['table'], row['key'], row['rows']),
+                # Access type ALL reads every row of the table
+                row['type'] == 'ALL' and row['table'] in tables)
+            for row in rows])
+
     def create_table(self, table, columns, force_create):
+        try:
+            return self.execute(
+                C("CREATE"),
+                C("TABLE"),
+                C("IF NOT EXISTS") if force_create else None,
+                self.identifier(table.name),
+                C("({})").join_format(C(", "), (
+                    self.column_definition(column) for column in columns)),
+                C("ENGINE={}").format(self.engine)
+            )
+        finally:
+            self.changed(table)
+
+    def create_index(self, table, index, force_create):
+        # MySQL has no CREATE INDEX IF NOT EXISTS
+        if force_create and index.name in {
+                name for name, columns, unique
+                in self.list_indexes(table.name)}:
+            return
         return self.execute(
             C("CREATE"),
-            C("TABLE"),
-            C("IF NOT EXISTS") if force_create else None,
+            C("UNIQUE") if index.unique else None,
+            C("INDEX"),
+            self.identifier(index.name),
+            C("ON"),
             self.identifier(table.name),
             C("({})").join_format(C(", "), (
-                self.column_definition(column) for column in columns)),
-            C("ENGINE={}").format(self.engine)
+                self.identifier(column.name) for column in index.columns)),
+        )
+
+    def list_indexes(self, table):
+        with self.connected():
+            rows = self.execute_ro(
+                C("SHOW INDEX FROM"), self.identifier(table)).fetchall()
+        indexes = {}
+        for row in rows:
+            non_unique, name, sequence, column = row[1:5]
+            if name == 'PRIMARY':
+                continue
+            columns, unique = indexes.setdefault(name, ({}, not non_unique))
+            columns[sequence] = column
+        # Functional key parts have no column names, and can't be
+        # represented as Indexes
+        return [(name, tuple(columns[key] for key in sorted(columns)), unique)
+                for name, (columns, unique) in indexes.items()
+                if None not in columns.values()]
+
+    def drop_index(self, table, index, ignore_absence):
+        if ignore_absence and index.name not in {
+                name for name, columns, unique
+                in self.list_indexes(table.name)}:
+            return
+        return self.execute(
+            C("DROP INDEX"),
+            self.identifier(index.name),
+            C("ON"),
+            self.identifier(table.name),
         )
 
     class operators(DbapiDriver.operators):
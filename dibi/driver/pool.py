@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+from ..error import PoolTimeoutError
+
+from collections import deque
+import threading
+import time
+
+
+class SingleConnection(object):
+    """
+    Connection source which shares one connection with every caller.
+
+    This is what a DbapiDriver uses unless it is asked to pool connections.
+
+    >>> source = SingleConnection(object)
+
+    >>> source.checkout() is source.checkout()
+    True
+    """
+    def __init__(self, connect):
+        self.connection = connect()
+
+    def checkout(self):
+        return self.connection
+
+    def checkin(self, connection):
+        pass
+
+    def close(self):
+        self.connection.close()
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe source of between minsize and maxsize connections.
+
+    Connections are returned to the pool by checkin() and reused by later
+    calls to checkout(), most recently used first. When all maxsize
+    connections are checked out, checkout() waits up to timeout seconds
+    (forever if timeout is None) for one to be returned.
+
+    Connections idle for more than idle_timeout seconds are closed, down to
+    minsize. If pre_ping is true, ping(connection) is called before a
+    connection is handed out, and connections for which it returns false
+    are replaced.
+
+    Before a connection is returned to the pool, reset(connection) is
+    called if given, to roll back any transaction left open. Connections
+    for which it raises are closed instead.
+
+    >>> import sqlite3
+
+    >>> pool = ConnectionPool(lambda: sqlite3.connect(':memory:'),
+    ...                       minsize=1, maxsize=2, timeout=0)
+
+    >>> a = pool.checkout()
+
+    >>> b = pool.checkout()
+
+    >>> pool.checkout()
+    Traceback (most recent call last):
+     ...
+    dibi.error.PoolTimeoutError: All 2 connections are in use
+
+    >>> pool.checkin(b)
+
+    >>> pool.checkout() is b
+    True
+    """
+    def __init__(self, connect, minsize=1, maxsize=5, idle_timeout=None,
+                 pre_ping=False, timeout=None, ping=None, reset=None):
+        if maxsize < 1 or not 0 <= minsize <= maxsize:
+            raise ValueError("Expected 0 <= minsize <= maxsize and "
+                             "maxsize >= 1, got {}, {}".format(
+                                 minsize, maxsize))
+        self.connect = connect
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.pre_ping = pre_ping
+        self.timeout = timeout
+        self.ping = ping
+        self.reset = reset
+        # Idle connections and the time they were returned, oldest first
+        self.idle = deque()
+        # Number of open connections, whether idle or checked out
+        self.size = 0
+        self.condition = threading.Condition()
+        for _ in range(minsize):
+            self.idle.append((connect(), time.monotonic()))
+            self.size += 1
+
+    def __repr__(self):
+        return "<ConnectionPool({} idle, {} open, maxsize={})>".format(
+            len(self.idle), self.size, self.maxsize)
+
+    def expire(self):
+        # Must be called while holding self.condition
+        if self.idle_timeout is None:
+            return
+        oldest = time.monotonic() - self.idle_timeout
+        while (self.size > self.minsize and self.idle and
+               self.idle[0][1] < oldest):
+            connection, returned = self.idle.popleft()
+            self.size -= 1
+            connection.close()
+
+    def checkout(self):
+        """
+        Return a connection for the exclusive use of the caller.
+        """
+        deadline = (None if self.timeout is None
+                    else time.monotonic() + self.timeout)
+        with self.condition:
+            while True:
+                self.expire()
+                if self.idle:
+                    connection, returned = self.idle.pop()
+                    break
+                if self.size < self.maxsize:
+                    self.size += 1
+                    connection = None
+                    break
+                remaining = (None if deadline is None
+                             else deadline - time.monotonic())
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeoutError(
+                        "All {} connections are in use".format(self.maxsize))
+                self.condition.wait(remaining)
+        if connection is not None and self.pre_ping and self.ping:
+            if not self.ping(connection):
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+                connection = None
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                with self.condition:
+                    self.size -= 1
+                    self.condition.notify()
+                raise
+        return connection
+
+    def checkin(self, connection):
+        """
+        Return a connection obtained from checkout() to the pool.
+        """
+        if self.reset is not None:
+            try:
+                self.reset(connection)
+            except Exception:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+                with self.condition:
+                    self.size -= 1
+                    self.condition.notify()
+                return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self.condition:
+            while self.idle:
+                connection, returned = self.idle.popleft()
+                self.size -= 1
+                connection.close()
@@ -1,18 +1,20 @@
 #!/usr/bin/env python
 
-from ..common import Column
+from ..common import Column, PlanStep, QueryPlan
 from .common import DbapiDriver, C, register, NoSuchTableError, operator
 from ..error import (NoSuchTableError, NoSuchDatabaseError, TableAlreadyExists)
-from ..datatype import Text, Integer, Float, Blob, DateTime
+from ..datatype import DataType, Text, Integer, Float, Blob, DateTime
 
 import sqlite3
 
 
 @register('sqlite')
 class SQLiteDriver(DbapiDriver):
-    def __init__(self, path=':memory:', create=True, debug=False):
+    def __init__(self, path=':memory:', create=True, debug=False, pool=None):
         self.path = path
         if path is None or path == ':memory:':
+            if pool is not None:
+                raise ValueError("In-memory databases can't be pooled")
             path = ':memory:'
             uri = False
         else:
@@ -24,11 +26,23 @@ class SQLiteDriver(DbapiDriver):
                 'c' if create else '',
             )
             uri = True
+        # Pooled connections are used by whichever thread checks them out
         super(SQLiteDriver, self).__init__(
-            sqlite3, path, sqlite3.PARSE_DECLTYPES, uri=uri)
+            sqlite3, path, sqlite3.PARSE_DECLTYPES, uri=uri,
+            check_same_thread=pool is None, pool=pool)
+        self.features.add('transactions')
+        # Python 3.11 and later can ask the library for its compiled limit
+        with self.connected():
+            getlimit = getattr(self.connection, 'getlimit', None)
+            if getlimit is not None:
+                self.parameter_limit = getlimit(
+                    sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
 
     identifier_quote = C('"')
 
+    # The default SQLITE_MAX_VARIABLE_NUMBER of libraries before 3.32
+    parameter_limit = 999
+
     def __repr__(self):
         return "SQLiteDriver(path={!r})".format(self.path)
 
@@ -54,6 +68,25 @@ class SQLiteDriver(DbapiDriver):
         if isinstance(error, sqlite3.Error):
             raise Exception((error, self.last_statement))
 
+    def on_conflict(self, names, conflict_names):
+        updated = [name for name in names if name not in conflict_names]
+        return (
+            C("ON CONFLICT"),
+            C("({})").join_format(C(", "), (
+                self.identifier(name) for name in conflict_names)),
+        ) + ((
+            C("DO UPDATE SET"),
+            C(", ").join(C("{0}=excluded.{0}").format(self.identifier(name))
+                         for name in updated),
+        ) if updated else (C("DO NOTHING"),))
+
+    def begin(self):
+        # The sqlite3 module only begins transactions implicitly before
+        # data modification statements, which would leave a savepoint to
+        # start (and its release to commit) the transaction.
+        if not self.connection.in_transaction:
+            self.execute_ro(C("BEGIN"))
+
     def map_type(self, database_type, database_size):
         return dict(
             INT=C("INT"),
@@ -64,14 +97,36 @@ class SQLiteDriver(DbapiDriver):
         )[database_type]
 
     def unmap_type(self, database_type):
-        return dict(
+        """
+        Returns the datatype of a column declared with database_type. Types
+        not created by dibi are matched by SQLite's rules of type affinity.
+
+        >>> driver = SQLiteDriver()
+
+        >>> driver.unmap_type('VARCHAR(20)'), driver.unmap_type('BIGINT')
+        (<class 'dibi.datatype.Text'>, <class 'dibi.datatype.Integer'>)
+        """
+        datatype = dict(
             TEXT=Text,
             INTEGER=Integer,
             INT=Integer,
             REAL=Float,
             BLOB=Blob,
             TIMESTAMP=DateTime,
-        )[database_type]
+        ).get(database_type)
+        if datatype is not None:
+            return datatype
+        affinity = database_type.upper()
+        if 'INT' in affinity:
+            return Integer
+        elif any(word in affinity for word in ('CHAR', 'CLOB', 'TEXT')):
+            return Text
+        elif any(word in affinity for word in ('REAL', 'FLOA', 'DOUB')):
+            return Float
+        elif not affinity or 'BLOB' in affinity:
+            # Values are stored exactly as they are given
+            return DataType
+        return self.unknown_type(database_type)
 
     def column_definition(self, column):
         if column.autoincrement:
@@ -88,12 +143,16 @@ class SQLiteDriver(DbapiDriver):
         )
 
     def list_tables(self):
-        return (name for (name,) in self.execute_ro(
-            C("SELECT name FROM sqlite_master WHERE type='table'")))
+        with self.connected():
+            rows = self.execute_ro(
+                C("SELECT name FROM sqlite_master WHERE type='table'")
+            ).fetchall()
+        return (name for (name,) in rows)
 
     def list_columns(self, table):
-        rows = self.execute_ro(C("PRAGMA table_info({})").format(
-            self.identifier(table))).fetchall()
+        with self.connected():
+            rows = self.execute_ro(C("PRAGMA table_info({})").format(
+                self.identifier(table))).fetchall()
         # An empty result set indicates the table doesn't exist
         if not rows:
             raise NoSuchTableError(table)
@@ -105,5 +164,75 @@ class SQLiteDriver(DbapiDriver):
                 autoincrement=False,  # TODO: Detect rowid fields
             )
 
+    def reflect(self, names=None):
+        if names is not None:
+            names = list(names)
+        values = []
+        only = self.name_filter(C("m.name"), names, values)
+        with self.connected():
+            columns = self.execute_ro(
+                C("SELECT m.name, c.name, c.type, c.pk"
+                  " FROM sqlite_master AS m"
+                  " JOIN pragma_table_info(m.name) AS c"
+                  " WHERE m.type = 'table'"), *only + (
+                    C("ORDER BY m.rowid, c.cid"),),
+                values=self.bind(values)).fetchall()
+            indexes = self.execute_ro(
+                C("SELECT m.name, i.name, i.\"unique\", c.name"
+                  " FROM sqlite_master AS m"
+                  " JOIN pragma_index_list(m.name) AS i"
+                  " JOIN pragma_index_info(i.name) AS c"
+                  " WHERE m.type = 'table' AND i.origin = 'c'"), *only + (
+                    C("ORDER BY m.rowid, i.seq, c.seqno"),),
+                values=self.bind(values)).fetchall()
+        return self.group_reflected(names, (
+            (table, Column(None, None, name, self.unmap_type(type),
+                           primarykey=(pk > 0), autoincrement=False))
+            for table, name, type, pk in columns), indexes)
+
+    def explain(self, statement, values, tables):
+        # Tables are named in the plan unquoted, so may contain spaces
+        names = sorted(tables, key=lambda table: -len(table.name))
+        with self.connected():
+            rows = self.execute_ro(
+                statement='EXPLAIN QUERY PLAN ' + statement, values=values,
+            ).fetchall()
+        steps = []
+        for id, parent, notused, detail in rows:
+            operation, _, target = detail.partition(' ')
+            if target.startswith('TABLE '):
+                target = target[6:]
+            for table in names:
+                if target == table.name or target.startswith(
+                        table.name + ' '):
+                    break
+            else:
+                table = None
+            steps.append(PlanStep(
+                table, detail,
+                operation == 'SCAN' and table is not None))
+        return QueryPlan(statement, steps)
+
+    def list_indexes(self, table):
+        with self.connected():
+            indexes = [
+                (name, unique) for seq, name, unique, origin, partial
+                in self.execute_ro(C("PRAGMA index_list({})").format(
+                    self.identifier(table))).fetchall()
+                # Indexes created automatically for constraints can't be
+                # managed independently
+                if origin == 'c'
+            ]
+            result = []
+            for name, unique in indexes:
+                columns = tuple(column for seqno, cid, column in sorted(
+                    self.execute_ro(C("PRAGMA index_info({})").format(
+                        self.identifier(name))).fetchall()))
+                # Indexes on expressions have no column names, and can't be
+                # represented as Indexes
+                if None not in columns:
+                    result.append((name, columns, bool(unique)))
+            return result
+
     class operators(DbapiDriver.operators):
         SUM = operator("total({})")
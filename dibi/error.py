@@ -29,3 +29,27 @@ class ConnectionError(Error):
 
 class AuthenticationError(Error):
     pass
+
+
+class FullScanError(Error):
+    pass
+
+
+class PoolTimeoutError(ConnectionError):
+    pass
+
+
+class CartesianProductWarning(UserWarning):
+    pass
+
+
+class FullScanWarning(UserWarning):
+    pass
+
+
+class NonTransactionalWarning(UserWarning):
+    pass
+
+
+class UnknownTypeWarning(UserWarning):
+    pass
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+Measure the throughput of common operations with each configured driver.
+
+Each benchmark is run against tables of several sizes, and the best of
+several repeats is reported. Results may be saved as JSON, and compared
+with results saved earlier, in which case the exit status is 1 if any
+benchmark is slower than its baseline by more than the threshold.
+
+    python -m test.bench --output baseline.json
+    python -m test.bench --baseline baseline.json --threshold 0.2
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import dibi
+
+from .configuration import read_configuration, test_drivers
+
+
+TABLE_NAME = 'dibi benchmark'
+
+
+def create_table(db, size):
+    table = db.add_table(TABLE_NAME, primarykey='id')
+    table.add_column('name', dibi.Text)
+    table.add_column('number', dibi.Integer)
+    table.add_column('value', dibi.Float)
+    table.save()
+    if size:
+        table.insert_many(sample_rows(size))
+    return table
+
+
+def drop_table(db):
+    table = db.tables.get(TABLE_NAME) or db.add_table(TABLE_NAME)
+    table.drop()
+
+
+def sample_rows(size):
+    return [dict(name='item {}'.format(i), number=i, value=random.random())
+            for i in range(size)]
+
+
+class Benchmark(object):
+    """
+    Repeatable measurement of an operation on a table of size rows.
+
+    setup() returns the table, run() performs the operation and returns the
+    number of operations it counts as.
+    """
+
+    def __init__(self, name, run, setup=create_table, database=True):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        # Whether run() uses the database, or only the driver's SQL
+        # generation
+        self.database = database
+
+    def measure(self, db, size, repeat):
+        best = None
+        operations = 0
+        for _ in range(repeat):
+            drop_table(db)
+            table = self.setup(db, size)
+            start = time.perf_counter()
+            operations = self.run(table, size)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        drop_table(db)
+        return dict(benchmark=self.name, size=size, seconds=best,
+                    operations=operations,
+                    rate=operations / best if best else None)
+
+
+def insert_single(table, size):
+    for row in sample_rows(size):
+        table.insert(**row)
+    return size
+
+
+def insert_bulk(table, size):
+    table.insert_many(sample_rows(size))
+    return size
+
+
+def lookup_by_key(table, size):
+    lookups = min(size, 1000)
+    for _ in range(lookups):
+        table[random.randint(1, size)]
+    return lookups
+
+
+def filtered_scan(table, size):
+    scans = 10
+    for _ in range(scans):
+        (table.value > 0.5).select_all()
+    return scans
+
+
+def update_half(table, size):
+    (table.number < size // 2).update(value=0.0)
+    return size // 2
+
+
+def delete_half(table, size):
+    (table.number < size // 2).delete()
+    return size // 2
+
+
+def generate_sql(table, size, warm=False):
+    driver = table.db.driver
+    statements = 1000
+    for i in range(statements):
+        if not warm:
+            driver.statement_cache.clear()
+        ((table.number > i) & (table.columns['name'] != 'item')).select(
+            table.value, order_by=table.number, limit=10).statement()
+    return statements
+
+
+BENCHMARKS = [
+    Benchmark('insert', insert_single,
+              setup=lambda db, size: create_table(db, 0)),
+    Benchmark('insert_many', insert_bulk,
+              setup=lambda db, size: create_table(db, 0)),
+    Benchmark('lookup_by_key', lookup_by_key),
+    Benchmark('filtered_scan', filtered_scan),
+    Benchmark('update', update_half),
+    Benchmark('delete', delete_half),
+    Benchmark('compile_sql', generate_sql,
+              setup=lambda db, size: create_table(db, 0), database=False),
+    Benchmark('bind_sql', lambda table, size: generate_sql(table, size, True),
+              setup=lambda db, size: create_table(db, 0), database=False),
+]
+
+
+def run_benchmarks(configuration, sizes, repeat, names=None):
+    results = []
+    for name, driver, parameters, expect in test_drivers(configuration):
+        if expect is not None:
+            continue
+        parameters.pop('debug', None)
+        try:
+            db = dibi.DB(driver(**parameters))
+        except dibi.error.Error as error:
+            print("Skipping {}: {}".format(name, error), file=sys.stderr)
+            continue
+        for benchmark in BENCHMARKS:
+            if names and benchmark.name not in names:
+                continue
+            for size in (sizes if benchmark.database else sizes[:1]):
+                result = benchmark.measure(db, size, repeat)
+                result['driver'] = name
+                results.append(result)
+                print("{driver:<12} {benchmark:<14} {size:>8} rows "
+                      "{rate:>12.1f} ops/s".format(**result), file=sys.stderr)
+    return results
+
+
+def result_key(result):
+    return (result['driver'], result['benchmark'], result['size'])
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns results slower than their baseline by more than threshold, as
+    (result, baseline rate) pairs.
+
+    >>> compare([dict(driver='a', benchmark='b', size=1, rate=70.0)],
+    ...         [dict(driver='a', benchmark='b', size=1, rate=100.0)], 0.2)
+    [({'driver': 'a', 'benchmark': 'b', 'size': 1, 'rate': 70.0}, 100.0)]
+    """
+    baseline = {result_key(result): result['rate'] for result in baseline}
+    regressions = []
+    for result in results:
+        expected = baseline.get(result_key(result))
+        if expected and result['rate'] < expected * (1 - threshold):
+            regressions.append((result, expected))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help="comma-separated table sizes")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--benchmark', action='append', dest='names',
+                        help="run only this benchmark; may be repeated")
+    parser.add_argument('--output', help="save results as JSON to this file")
+    parser.add_argument('--baseline', help="compare with saved results")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="fraction by which a rate may fall below its "
+                             "baseline")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run_benchmarks(read_configuration(), sizes, args.repeat,
+                             args.names)
+    report = dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        results=results,
+    )
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline)['results'],
+                                  args.threshold)
+        for result, expected in regressions:
+            print("REGRESSION {driver} {benchmark} ({size} rows): "
+                  "{rate:.1f} ops/s, baseline {expected:.1f}".format(
+                      expected=expected, **result), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import builtins
+import configparser
+import dibi
+
+
+def read_configuration():
+    configuration = configparser.ConfigParser()
+    configuration.read([
+        'test/test_parameters.conf',
+        'test_parameters.conf',
+    ])
+    return configuration
+
+
+def get_testing_configurations(configuration, driver):
+    base_parameters = configuration[driver]
+    for section in configuration.sections():
+        name, colon, variant = section.partition(':')
+        if name == driver:
+            variant_parameters = dict(base_parameters)
+            variant_parameters.update(configuration[section])
+            yield (variant, variant_parameters)
+
+
+def get_driver_variants(configuration, base):
+    try:
+        return sorted(get_testing_configurations(configuration, base))
+    except KeyError:
+        return ()
+
+
+def load_drivers():
+    """
+    Returns the registered drivers which can be imported, by name, and the
+    errors raised importing the others, by module name.
+    """
+    registry = dibi.driver.registry
+    drivers = {}
+    errors = {}
+    for name in registry:
+        try:
+            drivers[name] = registry[name]
+        except ImportError as error:
+            errors[registry.modules.get(name, name)] = error
+    return drivers, errors
+
+
+def test_drivers(configuration):
+    drivers, errors = load_drivers()
+    for name, driver in sorted(drivers.items()):
+        for variant, parameters in get_driver_variants(configuration, name):
+            this_raises = parameters.pop('this raises', None)
+            if this_raises:
+                expect = getattr(dibi.error, this_raises, None)
+                if expect is None:
+                    expect = getattr(builtins, this_raises)
+                if not issubclass(expect, Exception):
+                    raise ValueError("Unable to find error {}".format(
+                        this_raises))
+            else:
+                expect = None
+            pool_size = parameters.pop('pool size', None)
+            if pool_size:
+                parameters['pool'] = dict(maxsize=int(pool_size))
+            parameters['debug'] = True
+            yield (('{}({})'.format(name, variant) if variant else name),
+                   driver, parameters, expect)
@@ -1,15 +1,23 @@
 
 
 import dibi
+from dibi.driver import instrumentation
+from dibi.driver.common import C
 
+import array
 import datetime
+import logging
+import sys
+import threading
+import warnings
 
 
 class test_driver(object):
     def __init__(self, suite, driver, parameters):
         self.suite = suite
         self.db = dibi.DB(driver(**parameters))
-        for name in ['table 1', 'table 2', 'missing table']:
+        for name in ['table 1', 'table 2', 'missing table',
+                     'cached table', 'odd table']:
             table = self.db.add_table(name)
             table.drop()
 
@@ -22,16 +30,46 @@ class test_driver(object):
             pass
         suite.test(self.create_table_already_exists)
         suite.test(self.list_tables)
+        suite.test(self.reflect_schema)
+        suite.test(self.reflect_unknown_types)
         suite.test(self.discover_forgotten_table)
+        suite.test(self.skip_expression_indexes)
         try:
             self.db.tables['forgotten'].drop()
         except KeyError:
             pass
+        suite.test(self.manage_indexes)
         suite.test(self.insert_rows)
+        suite.test(self.insert_many_rows)
         suite.test(self.select_row_by_id)
+        suite.test(self.cache_rows_by_key)
+        suite.test(self.cache_query_results)
+        suite.test(self.upsert_rows)
+        suite.test(self.update_many_rows)
         suite.test(self.select_equal_to_string)
         suite.test(self.select_equal_to_none)
+        suite.test(self.select_by_datetime)
+        suite.test(self.reuse_compiled_statements)
+        suite.test(self.select_bound_literals)
+        suite.test(self.select_members)
+        suite.test(self.select_in_batches)
+        suite.test(self.select_columns)
+        suite.test(self.instrument_statements)
+        suite.test(self.select_aggregates)
+        suite.test(self.select_ordered_slices)
+        suite.test(self.select_pages)
+        suite.test(self.select_joined)
+        suite.test(self.warn_cartesian_product)
+        suite.test(self.explain_full_scans)
+        suite.test(self.warn_without_transactions)
+        suite.test(self.transaction_scopes)
+        suite.test(self.transaction_commit_failure)
+        suite.test(self.pooled_concurrency)
+        suite.test(self.pool_resets_connections)
+        suite.test(self.commit_invalidates_results)
+        suite.test(self.commit_clears_row_cache)
         suite.test(self.update_selection)
+        suite.test(self.change_in_batches)
         suite.test(self.delete_all)
         suite.test(self.drop_tables)
 
@@ -72,23 +110,104 @@ class test_driver(object):
         tables = list(self.db.driver.list_tables())
         assert tables == ['table 1', 'table 2']
 
+    def reflect_schema(self):
+        names = ['table 1', 'table 2']
+        db = dibi.DB(self.db.driver)
+        tables = db.reflect(names)
+        assert [table.name for table in tables] == names
+        for table in tables:
+            known = self.db.tables[table.name]
+            assert list(table.columns.keys()) == list(known.columns.keys())
+            assert table.primarykey.name == known.primarykey.name
+        assert db.tables['table 2'].columns['value'].datatype is (
+            dibi.datatype.Text)
+        one_by_one = dibi.driver.common.Driver.reflect(self.db.driver, names)
+        assert [(name, [column.name for column in columns], indexes)
+                for name, columns, indexes in one_by_one] == [
+            (name, [column.name for column in columns], indexes)
+            for name, columns, indexes in self.db.driver.reflect(names)]
+        with self.suite.catch(dibi.error.NoSuchTableError):
+            db.reflect(['missing table'])
+        restored = dibi.DB(self.db.driver)
+        restored.add_schema(db.schema())
+        assert restored.schema() == db.schema()
+
+    def reflect_unknown_types(self):
+        driver = self.db.driver
+        driver.execute(
+            C("CREATE TABLE"), driver.identifier('odd table'),
+            C("(amount DECIMAL(10, 2), label TEXT)"))
+        db = dibi.DB(driver)
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                table, = db.reflect(['odd table'])
+            assert [warning.category for warning in caught] == [
+                dibi.error.UnknownTypeWarning]
+            assert table.columns['amount'].datatype is dibi.DataType
+            assert table.columns['label'].datatype is dibi.Text
+            table.insert(amount=2, label='two')
+            assert table.select_all() == [(2, 'two')]
+        finally:
+            (db.tables.get('odd table') or db.add_table('odd table')).drop()
+
     def discover_forgotten_table(self):
         forgotten = self.db.add_table('forgotten')
         forgotten.add_column('name', dibi.datatype.Text, primarykey=True)
+        forgotten.add_column('label', dibi.datatype.Text)
+        forgotten.add_index('label', unique=True, name='forgotten label')
         forgotten.save()
         with self.suite.catch():
             del self.db.tables['forgotten']
             discovered = self.db.find_table('forgotten')
             columns = discovered.columns
             names = list(columns.keys())
-            assert names == ['name']
+            assert names == ['name', 'label']
             column = columns['name']
             datatype = column.datatype
             assert issubclass(datatype, dibi.datatype.Text)
             primarykey = column.primarykey
             assert primarykey is True
+            index = discovered.indexes['forgotten label']
+            assert index.unique is True
+            assert [column.name for column in index.columns] == ['label']
         forgotten.drop()
 
+    def skip_expression_indexes(self):
+        driver = self.db.driver
+        driver.execute(
+            C("CREATE TABLE"), driver.identifier('odd table'),
+            C("(label VARCHAR(20), number INTEGER)"))
+        driver.execute(
+            C("CREATE INDEX"), driver.identifier('odd label'), C("ON"),
+            driver.identifier('odd table'), C("((LOWER(label)), number)"))
+        driver.execute(
+            C("CREATE INDEX"), driver.identifier('odd number'), C("ON"),
+            driver.identifier('odd table'), C("(number)"))
+        try:
+            assert [name for name, columns, unique in
+                    driver.list_indexes('odd table')] == ['odd number']
+            table = self.db.find_table('odd table')
+            assert list(table.indexes.keys()) == ['odd number']
+            table, = dibi.DB(driver).reflect(['odd table'])
+            assert list(table.indexes.keys()) == ['odd number']
+        finally:
+            (self.db.tables.get('odd table') or
+             self.db.add_table('odd table')).drop()
+
+    def manage_indexes(self):
+        table_1 = self.db.tables['table 1']
+        index = table_1.add_index('number', table_1.columns['name'])
+        assert index.name == 'table 1_number_name_index'
+        index.save()
+        indexes = self.db.driver.list_indexes('table 1')
+        assert indexes == [(index.name, ('number', 'name'), False)]
+        index.save(force_create=True)
+        table_1.drop_index(index.name)
+        assert self.db.driver.list_indexes('table 1') == []
+        assert index.name not in table_1.indexes
+        table_1.drop_index(index.name)
+
     def insert_rows(self):
         sample_1_id = self.db.tables['table 1'].insert(
             name='sample 1',
@@ -118,15 +237,96 @@ class test_driver(object):
         with self.suite.catch():
             assert sample_3_id == 3
 
+    def insert_many_rows(self):
+        table_2 = self.db.tables['table 2']
+        count = table_2.insert_many(
+            (dict(key='key {}'.format(i), value=str(i)) for i in range(10)),
+            batch_size=3)
+        assert count == 10
+        count = table_2.insert_many([('key a', 'a'), ('key b', 'b')])
+        assert count == 2
+        assert table_2.insert_many([]) == 0
+        assert len(table_2.select_all()) == 12
+        assert table_2['key 7'] == ('key 7', '7')
+
     def select_row_by_id(self):
         assert self.db.tables['table 1'][1] is not None
 
+    def cache_rows_by_key(self):
+        table_2 = self.db.tables['table 2']
+        cache = table_2.cache_rows(maxsize=2)
+        try:
+            assert table_2['key 1'] == ('key 1', '1')
+            assert table_2['key 1'] == ('key 1', '1')
+            (table_2.key == 'key 1').update(value='one')
+            assert table_2['key 1'] == ('key 1', 'one')
+            table_2['key 2'], table_2['key 3']
+            assert (cache.hits, cache.misses, cache.evictions) == (1, 4, 1)
+        finally:
+            (table_2.key == 'key 1').update(value='1')
+            table_2.row_cache = None
+
+    def cache_query_results(self):
+        table_2 = self.db.tables['table 2']
+        cache = self.db.cache_results()
+        try:
+            selection = (table_2.key == 'key 1').select(table_2.value)
+            assert list(selection) == [('1',)]
+            assert list(selection) == [('1',)]
+            assert cache.hits == 1
+            version = table_2.version
+            (table_2.key == 'key 1').update(value='one')
+            assert table_2.version > version
+            assert list(selection) == [('one',)]
+            assert cache.invalidations == 1
+            (table_2.key == 'key 1').update(value='1')
+            assert list(selection.derive(cache=False)) == [('1',)]
+            assert cache.hits == 1
+            for value in ['old', 'new']:
+                table = self.db.add_table('cached table')
+                table.add_column('value', dibi.Text)
+                table.save()
+                table.insert(value=value)
+                assert table.select_all() == [(value,)]
+                table.drop()
+        finally:
+            self.db.result_cache = None
+
+    def upsert_rows(self):
+        table_2 = self.db.tables['table 2']
+        table_2.upsert('key', key='key 1', value='uno')
+        assert table_2['key 1'] == ('key 1', 'uno')
+        count = table_2.upsert_many(
+            [table_2.key], [('key 1', '1'), ('key u', 'u')], batch_size=1)
+        assert count == 2
+        assert table_2['key 1'] == ('key 1', '1')
+        assert table_2['key u'] == ('key u', 'u')
+        (table_2.key == 'key u').delete()
+        assert table_2.count() == 12
+
+    def update_many_rows(self):
+        table_2 = self.db.tables['table 2']
+        count = table_2.update_many(
+            [dict(key='key 1', value='one'), dict(key='key 2', value='two')])
+        assert count == 2
+        assert table_2['key 2'] == ('key 2', 'two')
+        with self.suite.catch(Exception):
+            table_2.update_many([dict(key='key 1', value='1'),
+                                 dict(key='key 2', missing='2')])
+        assert table_2['key 1'] == ('key 1', 'one')
+        table_2.update_many([dict(key='key 1', value='1'),
+                             dict(key='key 2', value='2')], key=table_2.key)
+        assert table_2['key 1'] == ('key 1', '1')
+
     def select_equal_to_string(self):
         table_1 = self.db.tables['table 1']
         rows = list((table_1.columns['name'] == 'sample 2').select())
         assert len(rows) == 1
         name, number, value, binary_data, timestamp = rows[0]
         assert number == 83
+        assert timestamp == datetime.datetime(1402, 2, 17, 4, 32, 55)
+        row = rows[0]
+        assert row.number == row['number'] == row[table_1.number] == 83
 
     def select_equal_to_none(self):
         table_1 = self.db.tables['table 1']
@@ -136,12 +336,427 @@ class test_driver(object):
         name, number, value, binary_data, timestamp = rows[0]
         assert name == 'sample 3'
 
+    def select_by_datetime(self):
+        table_1 = self.db.tables['table 1']
+        name = table_1.columns['name']
+        timestamp = table_1.columns['timestamp']
+        moment = datetime.datetime(1402, 2, 17, 4, 32, 55)
+        assert (timestamp == moment).select_all(name) == [('sample 2',)]
+        assert timestamp.in_([moment]).select_all(name) == [('sample 2',)]
+        assert len((timestamp > moment).select_all()) == 1
+        null = None
+        pages = list((timestamp != null).select(name).pages(timestamp, 1))
+        assert pages == [[('sample 2',)], [('sample 1',)]]
+        with self.suite.catch(ValueError):
+            table_1.insert(name='sample 4', number=2.7)
+        with self.suite.catch(TypeError):
+            table_1.insert(name=b'sample 4')
+        assert table_1.count() == 3
+
+    def reuse_compiled_statements(self):
+        table_1 = self.db.tables['table 1']
+        cache = self.db.driver.statement_cache
+        list((table_1.number > 50).select(table_1.number))
+        hits, misses = cache.hits, cache.misses
+        rows = list((table_1.number > 80).select(table_1.number))
+        assert (cache.hits, cache.misses) == (hits + 1, misses)
+        assert rows == [(83,)]
+
+    def select_bound_literals(self):
+        table_1 = self.db.tables['table 1']
+        rows = list((table_1.value > 16.5).select(table_1.number))
+        assert rows == [(83,)]
+        binary_data = b'\xf2\x15\xdb\xf3\nN\x91\xa0\xf0\xa3}\x7fWPE'
+        rows = list((table_1.binary_data == binary_data).select(
+            table_1.number))
+        assert rows == [(6,)]
+
+    def select_members(self):
+        table_2 = self.db.tables['table 2']
+        keys = ['key {}'.format(i) for i in range(10)]
+        rows = table_2.key.in_(keys[2:5] + ['missing']).select_all()
+        assert sorted(row.key for row in rows) == keys[2:5]
+        assert len(table_2.key.not_in(keys).select_all()) == 2
+        assert table_2.key.in_([]).select_all() == []
+        assert table_2.key.between('key 3', 'key 5').count() == 3
+        driver = self.db.driver
+        limit = driver.parameter_limit
+        driver.parameter_limit = 4
+        try:
+            selection = ((table_2.value != 'x') & table_2.key.in_(keys)
+                         ).select(cache=False)
+            assert len(selection.chunks()) == 4
+            assert len(list(selection)) == selection.count() == 10
+            repeated = table_2.key.in_(keys[:3] + keys[:3]).select(
+                cache=False)
+            assert len(list(repeated)) == repeated.count() == 3
+            found = table_2.get_many(keys[::-1] + ['missing'])
+        finally:
+            driver.parameter_limit = limit
+        assert sorted(found) == keys
+        assert found['key 7'] == table_2['key 7']
+
+    def select_in_batches(self):
+        table_1 = self.db.tables['table 1']
+        selection = table_1.select(table_1.number)
+        batches = list(selection.batches(2))
+        assert [len(rows) for rows in batches] == [2, 1]
+        assert list(selection.iter(arraysize=2)) == batches[0] + batches[1]
+
+    def select_columns(self):
+        table_1 = self.db.tables['table 1']
+        columns = table_1.select(
+            table_1.number, table_1.value, table_1.columns['name'],
+            table_1.timestamp, order_by=table_1.number,
+        ).to_columns(arraysize=2)
+        assert columns.number == array.array('q', [6, 46, 83])
+        assert columns.value == array.array('d', [2, -5.498, 16.937])
+        assert columns.name == ['sample 3', 'sample 1', 'sample 2']
+        assert columns.timestamp[0] is None
+        assert columns.timestamp[1] == datetime.datetime(
+            1900, 1, 1, 12, 15, 14)
+
+    def instrument_statements(self):
+        table_1 = self.db.tables['table 1']
+        driver = self.db.driver
+        statements = []
+        statistics = instrumentation.StatementStatistics()
+        logger = logging.getLogger('test.slow_query')
+        logger.disabled = True
+        slow = instrumentation.SlowQueryLog(threshold=0, logger=logger)
+        driver.before_execute.append(
+            lambda statement, values: statements.append(statement))
+        driver.after_execute.extend([statistics, slow])
+        try:
+            assert len((table_1.number > 6).select_all()) == 2
+            assert len((table_1.number > 46).select_all()) == 1
+        finally:
+            del driver.before_execute[:], driver.after_execute[:]
+        assert len(statements) == 2
+        report, = statistics.report()
+        assert (report.calls, report.rows) == (2, 3)
+        assert [execution.rowcount for execution in slow.entries] == [2, 1]
+        last_statement = driver.last_statement
+        other_thread = []
+        thread = threading.Thread(
+            target=lambda: other_thread.append(driver.last_statement))
+        thread.start()
+        thread.join()
+        assert other_thread == [None] and last_statement == statements[-1]
+
+    def select_aggregates(self):
+        table_1 = self.db.tables['table 1']
+        assert table_1.count() == 3
+        assert (table_1.number > 40).select().count() == 2
+        assert table_1.select(table_1.number, distinct=True).count() == 3
+        assert table_1.select(table_1.columns['name'], table_1.number,
+                              distinct=True).count() == 3
+        assert table_1.select(limit=2).count() == 2
+        assert table_1.select(table_1.number.sum()).count() == 1
+        assert table_1.select(table_1.number + 1).count() == 3
+        assert table_1.select(offset=1).count() == 2
+        assert table_1.select(table_1.number > 40, table_1.number.count(),
+                              group_by=table_1.number > 40).count() == 2
+        (total,), = table_1.select(table_1.number.sum())
+        assert total == 135
+        rows = sorted(table_1.select(
+            table_1.number > 40, table_1.number.count(),
+            group_by=table_1.number > 40))
+        assert rows == [(0, 1), (1, 2)]
+
+    def select_ordered_slices(self):
+        table_1 = self.db.tables['table 1']
+        number = table_1.number
+        rows = table_1.select_all(number, order_by=number.desc())
+        assert rows == [(83,), (46,), (6,)]
+        rows = table_1.select_all(number, order_by=number, limit=2)
+        assert rows == [(6,), (46,)]
+        rows = table_1.select_all(number, order_by=number, limit=1, offset=1)
+        assert rows == [(46,)]
+        rows = table_1.select_all(number, order_by=number, offset=2)
+        assert rows == [(83,)]
+
+    def select_pages(self):
+        table_2 = self.db.tables['table 2']
+        key = table_2.columns['key']
+        pages = list(table_2.select(table_2.value).pages(key, 5))
+        assert [len(page) for page in pages] == [5, 5, 2]
+        assert sorted(row for page in pages for row in page) == sorted(
+            table_2.select_all(table_2.value))
+        pages = list((table_2.value > '5').select(key).pages(key, 2))
+        assert pages == [[('key 6',), ('key 7',)], [('key 8',), ('key 9',)],
+                         [('key a',), ('key b',)]]
+
+    def select_joined(self):
+        table_1 = self.db.tables['table 1']
+        table_2 = self.db.tables['table 2']
+        name = table_1.columns['name']
+        on = (name == table_2.value)
+        assert len(table_1.join(table_2, on=on).select_all()) == 0
+        rows = table_1.join(table_2, on=on, kind='left').select_all(
+            name, table_2.value)
+        assert sorted(rows) == [('sample 1', None), ('sample 2', None),
+                                ('sample 3', None)]
+        joined = table_1.join(table_2, kind='cross')
+        assert joined.count() == 36
+        assert joined.where(table_2.value == 'a').count() == 3
+
+    def warn_cartesian_product(self):
+        table_1 = self.db.tables['table 1']
+        table_2 = self.db.tables['table 2']
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            ((table_1.number > 0) & (table_2.value == 'a')).select()
+            (table_1.number == table_2.value).select()
+        assert [warning.category for warning in caught] == [
+            dibi.error.CartesianProductWarning]
+
+    def explain_full_scans(self):
+        table_1 = self.db.tables['table 1']
+        plan = (table_1.number == 6).explain()
+        assert plan.full_scans == [table_1]
+        assert (table_1.primarykey == 1).explain().full_scans == []
+        self.db.check_full_scans(threshold=3)
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                (table_1.number == 6).select_all()
+                (table_1.number == 6).select_all()
+                table_1[1]
+        finally:
+            self.db.check_full_scans(threshold=None)
+        assert [warning.category for warning in caught] == [
+            dibi.error.FullScanWarning]
+        self.db.check_full_scans(threshold=3, error=True)
+        try:
+            for attempt in range(2):
+                with self.suite.catch(dibi.error.FullScanError):
+                    (table_1.number == 6).select_all()
+        finally:
+            self.db.check_full_scans(threshold=None)
+
+    def warn_without_transactions(self):
+        features = self.db.driver.features
+        supported = 'transactions' in features
+        features.discard('transactions')
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                with self.db.transaction():
+                    pass
+        finally:
+            if supported:
+                features.add('transactions')
+        assert [warning.category for warning in caught] == [
+            dibi.error.NonTransactionalWarning]
+
+    def transaction_scopes(self):
+        if 'transactions' not in self.db.driver.features:
+            return
+        table_2 = self.db.tables['table 2']
+        count = table_2.count()
+        try:
+            with self.db.transaction():
+                table_2.insert(key='discarded', value='x')
+                raise ZeroDivisionError
+        except ZeroDivisionError:
+            pass
+        assert table_2.count() == count
+        with self.db.transaction():
+            table_2.insert(key='kept', value='x')
+            try:
+                with self.db.transaction():
+                    table_2.insert(key='rolled back', value='x')
+                    raise ZeroDivisionError
+            except ZeroDivisionError:
+                pass
+            with self.db.transaction():
+                table_2.insert(key='released', value='x')
+        assert sorted((table_2.value == 'x').select_all(
+            table_2.columns['key'])) == [('kept',), ('released',)]
+        (table_2.value == 'x').delete()
+
+    def transaction_commit_failure(self):
+        driver = self.db.driver
+        if 'transactions' not in driver.features:
+            return
+        table_2 = self.db.tables['table 2']
+        count = table_2.count()
+        handled = []
+
+        def commit():
+            raise ZeroDivisionError
+
+        driver.commit = commit
+        driver.handle_exception = handled.append
+        try:
+            with self.suite.catch(ZeroDivisionError):
+                with self.db.transaction():
+                    table_2.insert(key='uncommitted', value='x')
+        finally:
+            del driver.commit
+            del driver.handle_exception
+        assert [type(error) for error in handled] == [ZeroDivisionError]
+        assert driver.transaction_depth == 0
+        assert table_2.count() == count
+
+    def pooled_concurrency(self):
+        driver = self.db.driver
+        if not getattr(driver, 'pooled', False):
+            return
+        table_2 = self.db.tables['table 2']
+        keys = sorted(row.key for row in table_2.select(table_2.key))
+        count = table_2.count()
+        errors = []
+
+        def worker(number):
+            try:
+                for i in range(20):
+                    size = i % len(keys) + 1
+                    rows = table_2.key.in_(keys[:size]).select_all()
+                    assert len(rows) == size
+                    key = 'thread {} {}'.format(number, i)
+                    with self.db.transaction():
+                        table_2.insert(key=key, value='x')
+                        assert table_2[key] == (key, 'x')
+                    (table_2.key == key).delete()
+            except Exception as error:
+                errors.append(error)
+
+        # Evict compiled statements constantly, and switch threads often
+        maxsize = driver.statement_cache.maxsize
+        interval = sys.getswitchinterval()
+        driver.statement_cache.maxsize = 2
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=worker, args=(number,))
+                       for number in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            driver.statement_cache.maxsize = maxsize
+            sys.setswitchinterval(interval)
+        assert errors == []
+        assert table_2.count() == count
+
+    def pool_resets_connections(self):
+        driver = self.db.driver
+        if not getattr(driver, 'pooled', False):
+            return
+        table_2 = self.db.tables['table 2']
+        count = table_2.count()
+        # Leave a transaction open on a connection as it is checked in
+        with driver.connected():
+            driver.begin()
+            driver.execute_ro(C("DELETE FROM"),
+                              driver.identifier(table_2.name))
+        results = []
+
+        def other_thread():
+            results.append(table_2.count())
+            table_2.insert(key='other thread', value='x')
+            (table_2.key == 'other thread').delete()
+            results.append(table_2.count())
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+        assert results == [count, count]
+        assert table_2.count() == count
+
+    def commit_invalidates_results(self):
+        driver = self.db.driver
+        if (not getattr(driver, 'pooled', False) or
+                'transactions' not in driver.features):
+            return
+        table_2 = self.db.tables['table 2']
+        row = table_2.key == 'key 1'
+        selection = row.select(table_2.value)
+        before = list(selection.derive(cache=False))
+        updated, committing = threading.Event(), threading.Event()
+        errors = []
+
+        def writer():
+            try:
+                with self.db.transaction():
+                    row.update(value='committed')
+                    updated.set()
+                    committing.wait(10)
+            except Exception as error:
+                errors.append(error)
+        self.db.cache_results()
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            assert updated.wait(10)
+            # Cached while the change is invisible to this thread
+            assert list(selection) == before
+            committing.set()
+            thread.join()
+            assert not errors
+            assert list(selection) == [('committed',)]
+        finally:
+            committing.set()
+            thread.join()
+            self.db.result_cache = None
+            row.update(value=before[0].value)
+
+    def commit_clears_row_cache(self):
+        driver = self.db.driver
+        if (not getattr(driver, 'pooled', False) or
+                'transactions' not in driver.features):
+            return
+        table_2 = self.db.tables['table 2']
+        before = table_2['key 1']
+        updated, committing = threading.Event(), threading.Event()
+        errors = []
+
+        def writer():
+            try:
+                with self.db.transaction():
+                    (table_2.key == 'key 1').update(value='committed')
+                    updated.set()
+                    committing.wait(10)
+            except Exception as error:
+                errors.append(error)
+        table_2.cache_rows()
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            assert updated.wait(10)
+            # Cached while the change is invisible to this thread
+            assert table_2['key 1'] == before
+            committing.set()
+            thread.join()
+            assert not errors
+            assert table_2['key 1'] == ('key 1', 'committed')
+            assert table_2.get_many(['key 1'])['key 1'].value == 'committed'
+        finally:
+            committing.set()
+            thread.join()
+            table_2.row_cache = None
+            (table_2.key == 'key 1').update(value=before.value)
+
     def update_selection(self):
         value = self.db.tables['table 1'].value
         assert len((value < 0).select_all()) == 1
         (value < 0).update(value=100)
         assert len((value < 0).select_all()) == 0
 
+    def change_in_batches(self):
+        table_2 = self.db.tables['table 2']
+        late = (table_2.key > 'key 5')
+        counts = []
+        assert late.update_in_batches(
+            dict(value='late'), 2, progress=counts.append) == 6
+        assert counts == [2, 4, 6]
+        assert (table_2.value == 'late').select().count() == 6
+        assert late.delete(batch_size=4, pause=0.001) == 6
+        assert table_2.count() == 6
+        with self.suite.catch(ValueError):
+            late.delete(batch_size=0)
+
     def delete_all(self):
         table_1 = self.db.tables['table 1']
         assert len(table_1.select_all()) > 0
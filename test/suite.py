@@ -322,9 +322,10 @@ class TestSuite(object):
                     source_block=example.source.strip(),
                 ), expected=example.want.rstrip(), actual=got))
 
-    def run_package_docstrings(self, package, **options):
+    def run_package_docstrings(self, package, exclude=(), **options):
         for module in find_package_module_names(package):
-            self.run_module_docstrings(module, **options)
+            if module not in exclude:
+                self.run_module_docstrings(module, **options)
 
 
 class DocstringRunner(doctest.DocTestRunner):
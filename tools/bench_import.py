@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Measure how long a fresh interpreter takes to import dibi, and to connect
+to an in-memory SQLite database, and which driver dependencies are loaded
+along the way.
+
+Each measurement is made in a new process, so nothing is already imported.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Run in the child process; prints its measurements as JSON
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import dibi
+imported = time.perf_counter()
+{connect}
+connected = time.perf_counter()
+print(json.dumps(dict(
+    import_time=imported - start, connect_time=connected - imported,
+    modules=len(sys.modules),
+    loaded=sorted(name for name in {watched!r} if name in sys.modules))))
+"""
+
+# Modules which only some drivers need
+WATCHED = ['sqlite3', 'dibi.driver.sqlite', 'dibi.driver.mysql',
+           'mysql.connector']
+
+
+def probe(python, connect):
+    source = PROBE.format(
+        connect="dibi.DB.connect('sqlite')" if connect else "",
+        watched=WATCHED)
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [path for path in [environment.get('PYTHONPATH')] if path])
+    output = subprocess.check_output([python, '-c', source],
+                                     env=environment, cwd=ROOT)
+    return json.loads(output.decode())
+
+
+def measure(python, repeat, connect):
+    results = [probe(python, connect) for _ in range(repeat)]
+    key = 'connect_time' if connect else 'import_time'
+    times = [result[key] for result in results]
+    return dict(
+        min=min(times), median=statistics.median(times),
+        modules=results[-1]['modules'], loaded=results[-1]['loaded'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--python', default=sys.executable,
+                        help="interpreter to measure")
+    parser.add_argument('--json', action='store_true',
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    results = dict(
+        import_dibi=measure(args.python, args.repeat, connect=False),
+        connect_sqlite=measure(args.python, args.repeat, connect=True),
+    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print("{:<15} min {:7.1f} ms, median {:7.1f} ms, {:4} modules, "
+              "loaded: {}".format(
+                  name, result['min'] * 1000, result['median'] * 1000,
+                  result['modules'], ", ".join(result['loaded']) or "-"))
+
+
+if __name__ == '__main__':
+    main()
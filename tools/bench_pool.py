@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Measure concurrent read throughput of a file-backed SQLite database, with
+and without a connection pool.
+
+Each thread repeatedly looks up random rows by primary key. The unpooled
+case is simulated with a pool of one connection, which is how a single
+shared connection would have to be used safely from several threads.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import dibi  # noqa: E402
+
+
+def prepare(path, rows):
+    db = dibi.DB.connect('sqlite', path)
+    table = db.add_table('items', primarykey='id')
+    table.add_column('name', dibi.Text)
+    table.add_column('value', dibi.Float)
+    table.save()
+    table.insert_many(dict(name='item {}'.format(i), value=random.random())
+                      for i in range(rows))
+    db.driver.close()
+
+
+def run(path, rows, threads, queries, maxsize):
+    db = dibi.DB.connect('sqlite', path, pool=dict(
+        minsize=1, maxsize=maxsize))
+    table = db.find_table('items')
+
+    def worker():
+        for _ in range(queries):
+            table[random.randint(1, rows)]
+            (table.value > 0.999).select_all()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    db.driver.close()
+    return threads * queries * 2 / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite')
+        prepare(path, args.rows)
+        for maxsize in sorted({1, args.threads}):
+            rate = run(path, args.rows, args.threads, args.queries, maxsize)
+            print("{} threads, pool maxsize {:>2}: {:10.1f} queries/s".format(
+                args.threads, maxsize, rate))
+
+
+if __name__ == '__main__':
+    main()